@@ -4,23 +4,99 @@ import os
 # Add backend directory to sys.path to allow importing config
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from typing import List, Dict, Any, AsyncGenerator, Optional
+from typing import List, Dict, Any, AsyncGenerator, Optional, Deque, TYPE_CHECKING
 import json
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import lru_cache
+import numpy as np
 from typing_extensions import override
 from pydantic import PrivateAttr
 from google.adk.agents import Agent
-from google.adk.events.event import Event
-from google.adk.agents.invocation_context import InvocationContext
-from google.adk.models.google_llm import Gemini
-from google.genai import types
+
+if TYPE_CHECKING:
+    # Only needed for annotations; Event/types are imported where they are used
+    from google.adk.events.event import Event
+    from google.adk.agents.invocation_context import InvocationContext
 from config import OPTIMIZATION_AGENT_MODEL, USE_MEMBERSHIP_PRICE_FOR_CURRENT
 
+
+@lru_cache(maxsize=4096)
+def _parse_price(value) -> Optional[float]:
+    """Parse a "£1.20"-style price, returning None if it is empty or invalid"""
+    if not value:
+        return None
+    if isinstance(value, str) and value[0] == "£":
+        value = value[1:]
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _to_optional(value) -> Optional[float]:
+    """Convert a NumPy scalar back to a Python float, mapping NaN to None"""
+    return None if np.isnan(value) else float(value)
+
+
+# Bound once so formatting doesn't repeat the attribute lookup per value
+_P = '£{:.2f}'.format
+_NA = 'N/A'
+
+
+def format_price(value: Optional[float]) -> str:
+    """Format a price or saving for display, N/A if it is unknown"""
+    return _P(value) if value is not None else _NA
+
+
+@dataclass(slots=True)
+class OptResult:
+    """Optimization result for one product.
+
+    Prices and savings are kept as raw floats (None when unknown) and are
+    only formatted as "£X.XX" strings by ``to_dict`` for CSV/report output.
+    """
+    product_name: str
+    current_supermarket: str
+    current_regular_price: Optional[float]
+    current_membership_price: Optional[float]
+    cheapest_supermarket: str
+    cheapest_regular_price: Optional[float]
+    cheapest_membership_price: Optional[float]
+    savings_vs_current: Optional[float]
+    saving_cheapest_regular_vs_current_regular: Optional[float]
+    saving_cheapest_regular_vs_current_membership: Optional[float]
+    saving_cheapest_membership_vs_current_regular: Optional[float]
+    saving_cheapest_membership_vs_current_membership: Optional[float]
+    historical_low_warning: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Export as the formatted dict written to the results CSV"""
+        result = {
+            "product_name": self.product_name,
+            "current_supermarket": self.current_supermarket,
+            "current_regular_price": format_price(self.current_regular_price),
+            "current_membership_price": format_price(self.current_membership_price),
+            "cheapest_supermarket": self.cheapest_supermarket,
+            "cheapest_regular_price": format_price(self.cheapest_regular_price),
+            "cheapest_membership_price": format_price(self.cheapest_membership_price),
+            "savings_vs_current": format_price(self.savings_vs_current),
+            "saving_cheapest_regular_vs_current_regular": format_price(self.saving_cheapest_regular_vs_current_regular),
+            "saving_cheapest_regular_vs_current_membership": format_price(self.saving_cheapest_regular_vs_current_membership),
+            "saving_cheapest_membership_vs_current_regular": format_price(self.saving_cheapest_membership_vs_current_regular),
+            "saving_cheapest_membership_vs_current_membership": format_price(self.saving_cheapest_membership_vs_current_membership)
+        }
+        if self.historical_low_warning:
+            result["historical_low_warning"] = self.historical_low_warning
+        return result
+
+
 class OptimizationAgent(Agent):
-    _result_accumulator: Optional[List] = PrivateAttr(default=None)
+    _result_accumulator: Optional[Deque] = PrivateAttr(default=None)
     _final_summary: str = PrivateAttr(default="")
     _optimization_results: List = PrivateAttr(default_factory=list)
 
-    def __init__(self, result_accumulator: Optional[List] = None):
+    def __init__(self, result_accumulator: Optional[Deque] = None):
         instruction = """
         You are an Optimization Agent.
         Your goal is to analyze a list of products and their prices across different supermarkets to find the best deal.
@@ -52,11 +128,14 @@ class OptimizationAgent(Agent):
         return self._final_summary
 
     @property
-    def optimization_results(self) -> List:
+    def optimization_results(self) -> List[OptResult]:
         return self._optimization_results
 
     @override
-    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+    async def _run_async_impl(self, ctx: "InvocationContext") -> AsyncGenerator["Event", None]:
+        from google.adk.events.event import Event
+        from google.genai import types
+
         if not self._result_accumulator:
             print("⚠️ No results to optimize!")
             return
@@ -66,19 +145,22 @@ class OptimizationAgent(Agent):
         # The accumulator has flat list of search results.
         # We need to group them by product.
         
-        # Get unique products from accumulator to know what we have
-        products_map = {}
+        # Group results by product, keeping the product data from the
+        # first result seen for each product. Non-matches are dropped here
+        # so optimize() only ever sees found prices.
+        groups = defaultdict(list)
+        bases = {}
         for res in self._result_accumulator:
+            if not res.get('found'):
+                continue
             p_name = res['product']
-            if p_name not in products_map:
-                # Initialize with product data from the first result that has it
-                products_map[p_name] = {
-                    **res['product_data'],
-                    'found_prices': []
-                }
-            products_map[p_name]['found_prices'].append(res)
+            bases.setdefault(p_name, res['product_data'])
+            groups[p_name].append(res)
         
-        products_data = list(products_map.values())
+        products_data = [
+            {**bases[p_name], 'found_prices': found_prices}
+            for p_name, found_prices in groups.items()
+        ]
         
         # 2. Run Optimization Logic
         self._optimization_results = self.optimize(products_data)
@@ -98,12 +180,23 @@ class OptimizationAgent(Agent):
             content=types.Content(parts=[types.Part(text=self._final_summary)])
         )
 
-    def optimize(self, products_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def add_duplicate_results(self, rows: List[Dict[str, Any]]) -> None:
+        """Append one result per repeated CSV row of the product just optimized.
+        The rows reuse this run's found prices but keep their own current prices."""
+        found_prices = [res for res in self._result_accumulator or () if res.get('found')]
+        if found_prices:
+            self._optimization_results.extend(
+                self.optimize([{**row, 'found_prices': found_prices} for row in rows])
+            )
+
+    def optimize(self, products_data: List[Dict[str, Any]]) -> List[OptResult]:
         """Compute best prices and compare against current supermarket.
-        Returns a list of dicts suitable for CSV output with:
+        Returns a list of OptResult (see ``OptResult.to_dict`` for CSV output) with:
         - Current supermarket and prices (regular + membership if exists)
         - Cheapest option found (regular + membership if exists)
         - Savings compared to current supermarket
+        Every entry in an item's ``found_prices`` is expected to be a match
+        (``_run_async_impl`` filters out non-matches while grouping).
         """
         results = []
         for item in products_data:
@@ -114,66 +207,35 @@ class OptimizationAgent(Agent):
             found_prices = item.get("found_prices", [])
             
             # Parse current prices
-            current_regular_price = None
-            current_membership_price = None
-            try:
-                if current_regular_price_str:
-                    current_regular_price = float(str(current_regular_price_str).replace("£", ""))
-            except ValueError:
-                pass
-            try:
-                if current_membership_price_str:
-                    current_membership_price = float(str(current_membership_price_str).replace("£", ""))
-            except ValueError:
-                pass
+            current_regular_price = _parse_price(current_regular_price_str)
+            current_membership_price = _parse_price(current_membership_price_str)
             
             # Gather all prices (regular and membership) from search results
-            price_entries = []  # List of (supermarket, regular_price, membership_price)
+            supermarkets = []
+            price_rows = []  # One (regular_price, membership_price) row per supermarket
             for fp in found_prices:
-                if not fp.get("found"):
-                    continue
-                    
-                regular_price = None
-                membership_price = None
-                
-                # Parse regular price
-                regular_price_str = fp.get("regular_price")
-                if regular_price_str:
-                    try:
-                        regular_price = float(str(regular_price_str).replace("£", ""))
-                    except ValueError:
-                        pass
-                
-                # Parse membership price
-                membership_price_str = fp.get("membership_price")
-                if membership_price_str:
-                    try:
-                        membership_price = float(str(membership_price_str).replace("£", ""))
-                    except ValueError:
-                        pass
+                regular_price = _parse_price(fp.get("regular_price"))
+                membership_price = _parse_price(fp.get("membership_price"))
                 
                 # Only add if we have at least one price
                 if regular_price is not None or membership_price is not None:
-                    price_entries.append((
-                        fp["supermarket"],
-                        regular_price,
-                        membership_price
-                    ))
+                    supermarkets.append(fp["supermarket"])
+                    price_rows.append((regular_price, membership_price))
             
-            if not price_entries:
+            if not price_rows:
                 # No price data found, skip this product
                 continue
             
             # Find the cheapest option (considering membership price if available)
-            def get_best_price(entry):
-                """Get the lowest price from regular or membership"""
-                supermarket, regular, membership = entry
-                prices = [p for p in [regular, membership] if p is not None]
-                return min(prices) if prices else float('inf')
+            # Missing prices become NaN so the nan-aware reductions skip them
+            prices = np.array(price_rows, dtype=np.float64)  # shape (n_supermarkets, 2)
+            best_each = np.nanmin(prices, axis=1)
+            cheapest_idx = int(np.nanargmin(best_each))
             
-            cheapest_entry = min(price_entries, key=get_best_price)
-            cheapest_supermarket, cheapest_regular, cheapest_membership = cheapest_entry
-            cheapest_price = get_best_price(cheapest_entry)
+            cheapest_supermarket = supermarkets[cheapest_idx]
+            cheapest_regular = _to_optional(prices[cheapest_idx, 0])
+            cheapest_membership = _to_optional(prices[cheapest_idx, 1])
+            cheapest_price = float(best_each[cheapest_idx])
             
             # Calculate savings vs current supermarket
             # Use config preference to determine which price to use for current supermarket
@@ -194,72 +256,56 @@ class OptimizationAgent(Agent):
             elif current_price is not None:
                 savings_val = max(0.0, current_price - cheapest_price)
             
-            # Calculate all savings combinations
-            def calc_savings(price1, price2):
-                """Calculate savings, return N/A if either price is None"""
-                if price1 is not None and price2 is not None:
-                    # If price1 (cheapest) is actually more expensive, savings is negative
-                    # But we shouldn't really be in this branch if we did the check above correctly
-                    # unless we are comparing specific price types (e.g. reg vs mem)
-                    return f"£{(price2 - price1):.2f}"
-                return "N/A"
-            
-            saving_cheapest_regular_vs_current_regular = calc_savings(cheapest_regular, current_regular_price)
-            saving_cheapest_regular_vs_current_membership = calc_savings(cheapest_regular, current_membership_price)
-            saving_cheapest_membership_vs_current_regular = calc_savings(cheapest_membership, current_regular_price)
-            saving_cheapest_membership_vs_current_membership = calc_savings(cheapest_membership, current_membership_price)
+            # Calculate all savings combinations in one broadcast:
+            # savings[i, j] = current[j] - cheapest[i], with (regular, membership) on both axes.
+            # NaN (either price missing) becomes None.
+            current_pair = np.array([current_regular_price, current_membership_price], dtype=np.float64)
+            cheapest_pair = np.array([cheapest_regular, cheapest_membership], dtype=np.float64)
+            savings = current_pair[None, :] - cheapest_pair[:, None]
             
-            # Format the result
-            result = {
-                "product_name": product_name,
-                "current_supermarket": current_supermarket,
-                "current_regular_price": f"£{current_regular_price:.2f}" if current_regular_price is not None else "N/A",
-                "current_membership_price": f"£{current_membership_price:.2f}" if current_membership_price is not None else "N/A",
-                "cheapest_supermarket": cheapest_supermarket,
-                "cheapest_regular_price": f"£{cheapest_regular:.2f}" if cheapest_regular is not None else "N/A",
-                "cheapest_membership_price": f"£{cheapest_membership:.2f}" if cheapest_membership is not None else "N/A",
-                "savings_vs_current": f"£{savings_val:.2f}" if current_price is not None else "N/A",
-                "saving_cheapest_regular_vs_current_regular": saving_cheapest_regular_vs_current_regular,
-                "saving_cheapest_regular_vs_current_membership": saving_cheapest_regular_vs_current_membership,
-                "saving_cheapest_membership_vs_current_regular": saving_cheapest_membership_vs_current_regular,
-                "saving_cheapest_membership_vs_current_membership": saving_cheapest_membership_vs_current_membership
-            }
+            result = OptResult(
+                product_name=product_name,
+                current_supermarket=current_supermarket,
+                current_regular_price=current_regular_price,
+                current_membership_price=current_membership_price,
+                cheapest_supermarket=cheapest_supermarket,
+                cheapest_regular_price=cheapest_regular,
+                cheapest_membership_price=cheapest_membership,
+                savings_vs_current=savings_val if current_price is not None else None,
+                saving_cheapest_regular_vs_current_regular=_to_optional(savings[0, 0]),
+                saving_cheapest_regular_vs_current_membership=_to_optional(savings[0, 1]),
+                saving_cheapest_membership_vs_current_regular=_to_optional(savings[1, 0]),
+                saving_cheapest_membership_vs_current_membership=_to_optional(savings[1, 1])
+            )
             results.append(result)
             
         return results
 
-    async def generate_summary(self, optimization_results: List[Dict[str, Any]]) -> str:
+    async def generate_summary(self, optimization_results: List[OptResult]) -> str:
         """Generate a concise summary of total savings vs current supermarket."""
         if not optimization_results:
             return "No optimization results found."
             
-        total_savings = 0.0
-        for r in optimization_results:
-            savings_str = r.get("savings_vs_current", "N/A")
-            if savings_str != "N/A":
-                try:
-                    total_savings += float(savings_str.replace("£", ""))
-                except ValueError:
-                    pass
+        total_savings = sum(r.savings_vs_current for r in optimization_results if r.savings_vs_current is not None)
         
-        summary = f"💰 **Total Savings vs Current Supermarket: £{total_savings:.2f}**\n\n"
-        summary += "Best options per product:\n"
+        parts = [
+            f"💰 **Total Savings vs Current Supermarket: £{total_savings:.2f}**\n\n",
+            "Best options per product:\n",
+        ]
         for r in optimization_results:
-            current_price = r.get("current_membership_price", "N/A")
-            if current_price == "N/A":
-                current_price = r.get("current_regular_price", "N/A")
-            
-            cheapest_price = r.get("cheapest_membership_price", "N/A")
-            if cheapest_price == "N/A":
-                cheapest_price = r.get("cheapest_regular_price", "N/A")
+            current_price = r.current_membership_price
+            if current_price is None:
+                current_price = r.current_regular_price
             
-            savings = r.get("savings_vs_current", "N/A")
+            cheapest_price = r.cheapest_membership_price
+            if cheapest_price is None:
+                cheapest_price = r.cheapest_regular_price
             
-            summary += (
-                f"- {r['product_name']}: Switch from {r['current_supermarket']} ({current_price}) "
-                f"to {r['cheapest_supermarket']} ({cheapest_price}) - Save {savings}\n"
+            parts.append(
+                f"- {r.product_name}: Switch from {r.current_supermarket} ({format_price(current_price)}) "
+                f"to {r.cheapest_supermarket} ({format_price(cheapest_price)}) - Save {format_price(r.savings_vs_current)}\n"
             )
-        return summary
+        return "".join(parts)
 
 if __name__ == "__main__":
     import asyncio
@@ -295,7 +341,8 @@ if __name__ == "__main__":
         
         print("\n🧠 Optimizing...")
         results = agent.optimize(products_data)
-        print(json.dumps(results, indent=2))
+        if os.environ.get("GROCEFY_DEBUG"):
+            print(json.dumps([r.to_dict() for r in results], indent=2))
         
         print("\n📝 Generating Summary...")
         summary = await agent.generate_summary(results)
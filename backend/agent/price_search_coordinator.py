@@ -2,7 +2,7 @@
 # ---------------------------------------------------
 # This module provides a factory function that builds a **per‑product**
 # pipeline using result_accumulator for data sharing:
-#   * VisionAgents store results in shared result_accumulator list
+#   * VisionAgents store results in shared result_accumulator deque
 #   * A ParallelAgent runs all VisionAgents for a product
 #   * An OptimizationAgent consumes results from the same accumulator
 #   * The whole thing is wrapped in a SequentialAgent so it can be
@@ -11,14 +11,17 @@
 # The number of supermarkets and products is **dynamic** – they come
 # from `config.TARGET_SUPERMARKETS` and the CSV input.
 #
-# Usage (from `main.py`):
-#   for product in products:
-#       coordinator, results = create_price_search_pipeline(product, TARGET_SUPERMARKETS)
-#       await runner.run_debug(...)
-#       # Access results from the returned list
+# Usage (from `main.py`, where each call runs under a shared semaphore):
+#   outputs = await asyncio.gather(*[
+#       run_product(product, TARGET_SUPERMARKETS, session_id=...)
+#       for product in products
+#   ])
+#   # Each output is (result_accumulator, optimizer)
 #
-# The function returns a tuple: (SequentialAgent, result_accumulator)
+# `create_price_search_pipeline` returns a tuple:
+# (SequentialAgent, result_accumulator, OptimizationAgent)
 
+from collections import deque
 from typing import List, Dict
 from google.adk.agents import Agent, ParallelAgent, SequentialAgent
 from google.adk.models.google_llm import Gemini
@@ -32,13 +35,24 @@ def _make_output_key(supermarket: str) -> str:
     The key is lower‑cased and non‑alphanumeric characters are replaced
     with underscores so it can be used in the session state.
     """
-    import re
-    safe = re.sub(r"[^a-zA-Z0-9]", "_", supermarket.lower())
+    safe = supermarket.lower().translate(SAFE_CHAR_TABLE)
     return f"price_{safe}"
 
 from services.memory_service import HistoryCSVMemoryService
+from utils.csv_handler import make_safe_name, SAFE_CHAR_TABLE
 
-def create_price_search_pipeline(product: Dict, supermarkets: List[str], reference_image_path: str = None):
+# Shared across all product pipelines so the history is only loaded once
+_MEMORY_SERVICE = None
+
+def _get_memory_service() -> HistoryCSVMemoryService:
+    """Return the process-wide memory service, creating it on first use."""
+    global _MEMORY_SERVICE
+    if _MEMORY_SERVICE is None:
+        _MEMORY_SERVICE = HistoryCSVMemoryService()
+    return _MEMORY_SERVICE
+
+def create_price_search_pipeline(product: Dict, supermarkets: List[str], reference_image_path: str = None,
+                                 safe_product_name: str = None):
     """Build a per‑product pipeline.
 
     Parameters
@@ -49,6 +63,8 @@ def create_price_search_pipeline(product: Dict, supermarkets: List[str], referen
         The list of supermarket names from the config.
     reference_image_path: str, optional
         Path to reference image for visual comparison
+    safe_product_name: str, optional
+        Precomputed identifier-safe product name (see ``to_product_records``)
 
     Returns
     -------
@@ -57,17 +73,16 @@ def create_price_search_pipeline(product: Dict, supermarkets: List[str], referen
     """
     product_name = product["product_name"]
     
-    # Sanitize product name for agent name (alphanumeric + underscore only)
-    import re
-    safe_product_name = re.sub(r'[^a-zA-Z0-9_]', '_', product_name)
-    # Remove multiple underscores
-    safe_product_name = re.sub(r'_+', '_', safe_product_name).strip('_')
+    # Sanitize product name for agent name (alphanumeric + underscore only),
+    # unless it was already sanitized at CSV load time
+    if safe_product_name is None:
+        safe_product_name = make_safe_name(product_name)
     
-    # Shared accumulator for results
-    result_accumulator = []
+    # Shared accumulator for results (deque: cheap appends from concurrent agents)
+    result_accumulator = deque()
 
-    # Initialize Memory Service
-    memory_service = HistoryCSVMemoryService()
+    # Shared Memory Service
+    memory_service = _get_memory_service()
 
     # Define tool for agents to access memory
     def load_memory(query: str) -> str:
@@ -85,7 +100,9 @@ def create_price_search_pipeline(product: Dict, supermarkets: List[str], referen
                 supermarket=supermarket,
                 product_data=product,      # Pass full product data
                 result_accumulator=result_accumulator,
-                reference_image_path=reference_image_path  # NEW: for visual matching
+                reference_image_path=reference_image_path,  # NEW: for visual matching
+                safe_product_name=safe_product_name,
+                safe_supermarket=make_safe_name(supermarket)
             )
         )
 
@@ -106,3 +123,45 @@ def create_price_search_pipeline(product: Dict, supermarkets: List[str], referen
     )
 
     return coordinator, result_accumulator, optimizer
+
+
+async def run_product(product: Dict, supermarkets: List[str], session_id: str,
+                      reference_image_path: str = None, safe_product_name: str = None):
+    """Build and run the pipeline for one product.
+
+    Concurrency limits are the caller's job (see ``process_product`` in
+    ``main.py``), so many products can be gathered at once.
+
+    Parameters
+    ----------
+    product: dict
+        A row from the CSV (must contain at least ``product_name``).
+    supermarkets: list[str]
+        The list of supermarket names from the config.
+    session_id: str
+        Session ID unique to this product, so concurrent runs don't share state.
+    reference_image_path: str, optional
+        Path to reference image for visual comparison
+    safe_product_name: str, optional
+        Precomputed identifier-safe product name (see ``to_product_records``)
+
+    Returns
+    -------
+    tuple
+        (result_accumulator, OptimizationAgent) - The shared results and optimizer instance
+    """
+    coordinator, result_accumulator, optimizer = create_price_search_pipeline(
+        product,
+        supermarkets,
+        reference_image_path=reference_image_path,
+        safe_product_name=safe_product_name
+    )
+    runner = InMemoryRunner(agent=coordinator)
+
+    await runner.run_debug(
+        user_messages=f"Find best price for {product['product_name']}",
+        user_id="main_user",
+        session_id=session_id,
+        verbose=True
+    )
+    return result_accumulator, optimizer
@@ -4,17 +4,173 @@ import os
 # Add backend directory to sys.path to allow imports from tools
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from typing import List, Dict, Any, AsyncGenerator, Optional
+from typing import List, Dict, Any, AsyncGenerator, Optional, Deque, Tuple, TYPE_CHECKING
 from typing_extensions import override
 import asyncio
 import re
 from pydantic import PrivateAttr
 from google.adk.agents import Agent
-from google.adk.events.event import Event
-from google.adk.agents.invocation_context import InvocationContext
-from google.adk.models.google_llm import Gemini
-from tools.vision_price_fetcher import vision_fetch_product, vision_fetch_product_with_visual_match
+
+if TYPE_CHECKING:
+    # Only needed for annotations; the price tools (Playwright, OpenCV, Gemini)
+    # are imported when an agent is actually built
+    from google.adk.events.event import Event
+    from google.adk.agents.invocation_context import InvocationContext
 from config import VISION_AGENT_MODEL
+from utils.csv_handler import SAFE_CHAR_TABLE
+
+# Price-parsing patterns, compiled once at import.
+# A label only binds to a price within 40 characters (and before any other price).
+_REG_RE = re.compile(r'(?:Regular|Standard)[^£]{0,40}[£\u00a3]\s*\**\s*(\d+\.\d+)', re.IGNORECASE)
+_MEM_RE = re.compile(r'(?:Member|Clubcard|Nectar|Card)[^£]{0,40}[£\u00a3]\s*\**\s*(\d+\.\d+)', re.IGNORECASE)
+_ANY_RE = re.compile(r'[£\u00a3]\s*\**\s*(\d+\.\d+)')
+
+# All three patterns fused into one alternation so the text is scanned once;
+# the name of the matching group tells which kind of price was found
+_PRICE_RE = re.compile(
+    r'(?:Regular|Standard)[^£]{0,40}[£\u00a3]\s*\**\s*(?P<reg>\d+\.\d+)'
+    r'|(?:Member|Clubcard|Nectar|Card)[^£]{0,40}[£\u00a3]\s*\**\s*(?P<mem>\d+\.\d+)'
+    r'|[£\u00a3]\s*\**\s*(?P<any>\d+\.\d+)',
+    re.IGNORECASE
+)
+
+# Case-insensitive phrase checks, so the response text is never lowercased
+_NOT_FOUND_RE = re.compile(r'could not find', re.IGNORECASE)
+_MEMBER_HINT_RE = re.compile(r'member|clubcard', re.IGNORECASE)
+
+# Optional Hyperscan database: scans all three patterns in a single pass.
+# Hyperscan has no capture groups, so it only locates match starts and the
+# compiled patterns above extract the price at that offset.
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+_HS_REG, _HS_MEM, _HS_ANY = 0, 1, 2
+_hs_db = None
+if hyperscan is not None:
+    _hs_db = hyperscan.Database()
+    _hs_db.compile(
+        expressions=[
+            r"(?:Regular|Standard)[^£]{0,40}£\s*\**\s*\d+\.\d+".encode("utf-8"),
+            r"(?:Member|Clubcard|Nectar|Card)[^£]{0,40}£\s*\**\s*\d+\.\d+".encode("utf-8"),
+            r"£\s*\**\s*\d+\.\d+".encode("utf-8"),
+        ],
+        ids=[_HS_REG, _HS_MEM, _HS_ANY],
+        elements=3,
+        flags=[
+            hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_SOM_LEFTMOST,
+            hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_SOM_LEFTMOST,
+            hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_SOM_LEFTMOST,
+        ],
+    )
+
+
+def _scan_prices(text: str) -> Tuple[Optional[str], Optional[str], List[str]]:
+    """Return (regular, membership, other_prices) numbers found in an agent response.
+    ``other_prices`` lists unlabelled prices and is only meaningful as a fallback
+    when neither a regular nor a membership price was found."""
+    if _hs_db is None:
+        reg = mem = None
+        prices = []
+        for match in _PRICE_RE.finditer(text):
+            kind = match.lastgroup
+            if kind == "reg":
+                reg = reg or match.group("reg")
+            elif kind == "mem":
+                mem = mem or match.group("mem")
+            else:
+                prices.append(match.group("any"))
+            if reg and mem:
+                break
+        return reg, mem, prices
+
+    data = text.encode("utf-8")
+    first_start = {}
+    any_starts = set()
+
+    def on_match(pattern_id, start, end, flags, context):
+        if pattern_id == _HS_ANY:
+            any_starts.add(start)
+        else:
+            # Matches arrive in end-offset order, not start order: keep the
+            # leftmost start, like _PRICE_RE.finditer
+            first_start[pattern_id] = min(start, first_start.get(pattern_id, start))
+
+    _hs_db.scan(data, match_event_handler=on_match)
+
+    # Byte offsets -> str offsets, decoding each stretch of the buffer once
+    char_starts = {}
+    byte_pos = char_pos = 0
+    for byte_start in sorted(any_starts.union(first_start.values())):
+        char_pos += len(data[byte_pos:byte_start].decode("utf-8"))
+        byte_pos = byte_start
+        char_starts[byte_start] = char_pos
+
+    def extract(pattern, byte_start):
+        match = pattern.match(text, char_starts[byte_start])
+        return match.group(1) if match else None
+
+    reg = extract(_REG_RE, first_start[_HS_REG]) if _HS_REG in first_start else None
+    mem = extract(_MEM_RE, first_start[_HS_MEM]) if _HS_MEM in first_start else None
+    prices = [p for p in (extract(_ANY_RE, s) for s in sorted(any_starts)) if p]
+    return reg, mem, prices
+
+
+def _normalize_price(value) -> Optional[str]:
+    """Normalize a tool-reported price (e.g. "£2.50") to the "£X.XX" form, None if absent"""
+    if not value or not isinstance(value, str):
+        return None
+    match = _ANY_RE.search(value)
+    return f"£{match.group(1)}" if match else None
+
+
+def _structured_prices(response) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    """Extract (regular, membership) prices from a price tool's function response.
+    Returns None when the tool didn't report a matched product with a price."""
+    if not isinstance(response, dict):
+        return None
+    results = response.get("results")
+    if not results or not isinstance(results[0], dict):
+        return None
+    regular_price = _normalize_price(results[0].get("regular_price"))
+    membership_price = _normalize_price(results[0].get("membership_price"))
+    if regular_price is None and membership_price is None:
+        return None
+    return regular_price, membership_price
+
+
+# Instruction templates, built once at import. The visual variant adds the
+# reference image parameter and a note on visual matching.
+_INSTR_BODY = """
+        You are a Vision-based Price Fetching Agent.
+        Your goal is to find the exact price of '{product_name}' at '{supermarket}' using visual analysis.
+
+        <tool_desc>
+
+        When asked to find a price, always use this tool.
+        <visual_matching_note>
+        
+        IMPORTANT - Handling Results:
+        1. If the tool returns a product in 'results', report the 'regular_price' and 'membership_price' (if available).
+        2. If the tool returns an 'error':
+           - Check if there's a 'reason' field explaining why the product didn't match
+           - Check if there are 'similar_products' - these were found but don't exactly match
+           - Inform the user that the exact product wasn't found
+           - If similar products exist, mention them to help the user
+        3. Be clear and helpful - if the exact product isn't available, say so explicitly.
+        """
+
+_INSTR_TMPL_VISUAL = _INSTR_BODY.replace("<tool_desc>", """You have a tool `vision_fetch_product_with_visual_match`. Call it with:
+        - `supermarket`: "{supermarket}"
+        - `query`: "{product_name}"
+        - `reference_image_path`: "{reference_image_path}" (for visual comparison)""").replace("<visual_matching_note>", """
+        VISUAL MATCHING: This tool uses a reference image to verify product matches when names differ across supermarkets. It will try exact name matching first, then simplified name matching with visual verification.""")
+
+_INSTR_TMPL_PLAIN = _INSTR_BODY.replace("<tool_desc>", """You have a tool `vision_fetch_product`. Call it with:
+        - `supermarket`: "{supermarket}"
+        - `query`: "{product_name}\"""").replace("<visual_matching_note>", "")
+
 
 class VisionAgent(Agent):
     _delay: int = PrivateAttr(default=0)
@@ -22,7 +178,7 @@ class VisionAgent(Agent):
     _supermarket: str = PrivateAttr(default="")
     _product_data: Dict = PrivateAttr(default_factory=dict)
     _output_key: Optional[str] = PrivateAttr(default=None)
-    _result_accumulator: Optional[List] = PrivateAttr(default=None)
+    _result_accumulator: Optional[Deque] = PrivateAttr(default=None)
     _reference_image_path: Optional[str] = PrivateAttr(default=None)
 
     def __init__(self,
@@ -31,8 +187,10 @@ class VisionAgent(Agent):
                  product_data: Dict,
                  delay: int = 0,
                  output_key: Optional[str] = None,
-                 result_accumulator: Optional[List] = None,
-                 reference_image_path: Optional[str] = None):
+                 result_accumulator: Optional[Deque] = None,
+                 reference_image_path: Optional[str] = None,
+                 safe_product_name: Optional[str] = None,
+                 safe_supermarket: Optional[str] = None):
         
         # Check for API key
         if "GOOGLE_API_KEY" not in os.environ:
@@ -40,51 +198,26 @@ class VisionAgent(Agent):
 
         # Initialize tools
         # Use enhanced visual matching if reference image is available
+        from tools.vision_price_fetcher import vision_fetch_product, vision_fetch_product_with_visual_match
         if reference_image_path:
             tools = [vision_fetch_product_with_visual_match]
         else:
             tools = [vision_fetch_product]
 
-        # Instruction string
-        tool_name = "vision_fetch_product_with_visual_match" if reference_image_path else "vision_fetch_product"
-        
-        # Build tool parameters string (no f-string interpolation here, just literals)
-        if reference_image_path:
-            tool_desc = f"""You have a tool `{tool_name}`. Call it with:
-        - `supermarket`: "{supermarket}"
-        - `query`: "{product_name}"
-        - `reference_image_path`: "{reference_image_path}" (for visual comparison)"""
-        else:
-            tool_desc = f"""You have a tool `{tool_name}`. Call it with:
-        - `supermarket`: "{supermarket}"
-        - `query`: "{product_name}\""""
-        
-        visual_matching_note = """
-        VISUAL MATCHING: This tool uses a reference image to verify product matches when names differ across supermarkets. It will try exact name matching first, then simplified name matching with visual verification.""" if reference_image_path else ""
-        
-        instruction = f"""
-        You are a Vision-based Price Fetching Agent.
-        Your goal is to find the exact price of '{product_name}' at '{supermarket}' using visual analysis.
-
-        {tool_desc}
-
-        When asked to find a price, always use this tool.
-        {visual_matching_note}
-        
-        IMPORTANT - Handling Results:
-        1. If the tool returns a product in 'results', report the 'regular_price' and 'membership_price' (if available).
-        2. If the tool returns an 'error':
-           - Check if there's a 'reason' field explaining why the product didn't match
-           - Check if there are 'similar_products' - these were found but don't exactly match
-           - Inform the user that the exact product wasn't found
-           - If similar products exist, mention them to help the user
-        3. Be clear and helpful - if the exact product isn't available, say so explicitly.
-        """
+        # Instruction string: only the per-agent values are substituted
+        template = _INSTR_TMPL_VISUAL if reference_image_path else _INSTR_TMPL_PLAIN
+        instruction = template.format_map({
+            "product_name": product_name,
+            "supermarket": supermarket,
+            "reference_image_path": reference_image_path,
+        })
 
         # Call parent constructor directly, passing instruction
-        # Sanitize name to be a valid identifier
-        safe_product_name = re.sub(r'[^a-zA-Z0-9_]', '_', product_name)
-        safe_supermarket = re.sub(r'[^a-zA-Z0-9_]', '_', supermarket)
+        # Sanitize name to be a valid identifier (callers usually pass precomputed names)
+        if safe_product_name is None:
+            safe_product_name = product_name.translate(SAFE_CHAR_TABLE)
+        if safe_supermarket is None:
+            safe_supermarket = supermarket.translate(SAFE_CHAR_TABLE)
         agent_name = f"VisionAgent_{safe_supermarket}_{safe_product_name}"
         
         # Truncate if too long (optional but good practice)
@@ -109,7 +242,7 @@ class VisionAgent(Agent):
         self._reference_image_path = reference_image_path
 
     @override
-    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+    async def _run_async_impl(self, ctx: "InvocationContext") -> AsyncGenerator["Event", None]:
         # 1. Handle Delay (Rate Limiting)
         if self._delay > 0:
             # print(f"⏳ {self.name} waiting {self._delay}s...")
@@ -117,39 +250,44 @@ class VisionAgent(Agent):
         
         # 2. Run Agent Logic
         final_text_parts = []
+        structured = None  # (regular, membership) straight from the tool response
         async for event in super()._run_async_impl(ctx):
             yield event
-            # Accumulate text response
+            # Accumulate text response and capture structured tool output
             if hasattr(event, 'content') and event.content:
                 for part in event.content.parts:
                     if hasattr(part, 'text') and part.text:
                         final_text_parts.append(part.text)
+                    elif getattr(part, 'function_response', None):
+                        structured = _structured_prices(part.function_response.response) or structured
         
         # 3. Parse and Yield Results
         final_text = "".join(final_text_parts)
         
-        # Parse prices with robust regex
         regular_price = None
         membership_price = None
         
-        reg_match = re.search(r'(?:Regular|Standard).*?[£\u00a3]\s*[\*]*\s*(\d+\.\d+)', final_text, re.IGNORECASE)
-        mem_match = re.search(r'(?:Member|Clubcard|Nectar|Card).*?[£\u00a3]\s*[\*]*\s*(\d+\.\d+)', final_text, re.IGNORECASE)
-        
-        if reg_match:
-            regular_price = f"£{reg_match.group(1)}"
-        if mem_match:
-            membership_price = f"£{mem_match.group(1)}"
+        if structured:
+            # Happy path: the tool already returned prices, no need to parse text
+            regular_price, membership_price = structured
+        else:
+            # Parse prices from the agent's text response with robust regex
+            reg_value, mem_value, prices = _scan_prices(final_text)
             
-        # Fallback
-        if not regular_price and not membership_price:
-            prices = re.findall(r'[£\u00a3]\s*[\*]*\s*(\d+\.\d+)', final_text)
-            if prices:
-                regular_price = f"£{prices[0]}"
-                if len(prices) > 1 and ("member" in final_text.lower() or "clubcard" in final_text.lower()):
-                    membership_price = f"£{prices[1]}"
+            if reg_value:
+                regular_price = f"£{reg_value}"
+            if mem_value:
+                membership_price = f"£{mem_value}"
+                
+            # Fallback
+            if not regular_price and not membership_price:
+                if prices:
+                    regular_price = f"£{prices[0]}"
+                    if len(prices) > 1 and _MEMBER_HINT_RE.search(final_text):
+                        membership_price = f"£{prices[1]}"
         
         is_found = True
-        if "could not find" in final_text.lower() and not regular_price:
+        if not regular_price and _NOT_FOUND_RE.search(final_text):
             is_found = False
         
         result = {
@@ -210,12 +348,12 @@ if __name__ == "__main__":
             print(f"\n📝 Agent Response:\n{final_text}")
             
             # Test Regex
-            reg_match = re.search(r'(?:Regular|Standard).*?[£\u00a3]\s*[\*]*\s*(\d+\.\d+)', final_text, re.IGNORECASE)
+            reg_match = _REG_RE.search(final_text)
             if reg_match:
                 print(f"\n✅ Extracted Regular Price: £{reg_match.group(1)}")
             else:
                 # Fallback
-                prices = re.findall(r'[£\u00a3]\s*[\*]*\s*(\d+\.\d+)', final_text)
+                prices = _ANY_RE.findall(final_text)
                 if prices:
                     print(f"\n✅ Extracted Price (Fallback): £{prices[0]}")
                 else:
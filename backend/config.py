@@ -18,6 +18,17 @@ TARGET_SUPERMARKETS = ["Tesco", "Sainsburys", "Aldi", "Lidl", "Morrisons", "Wait
 # Model configuration
 VISION_MODEL = "gemini-2.0-flash"  # Model for vision-based price fetching tool
 
+# Browser configuration
+# Chromium runs headless by default; set VISION_HEADLESS=false to watch the browser while debugging
+VISION_HEADLESS = os.environ.get("VISION_HEADLESS", "true").lower() == "true"
+
+# Debugging
+DEBUG_DUMP_SCREENSHOTS = False  # Also write each search-results screenshot to backend/debug/ (screenshots are passed in memory)
+DEBUG_DESCRIBE_SEARCH_BOX = False  # Ask the vision model to describe the search box and log it (one extra screenshot + LLM call per fetch)
+
+# Reference image cropping
+FAST_FUSED_CROP = True  # One Gemini call for box + validation; falls back to the multi-pass crop on low confidence
+
 # Price Preference Configuration
 USE_MEMBERSHIP_PRICE_FOR_CURRENT = False  # If True, use membership price for current supermarket comparison; if False, use regular price
 
@@ -35,7 +46,12 @@ COORDINATOR_MODEL = "gemini-2.0-flash" # For agents that need a model but don't
 ENABLE_VISION_RATE_LIMITING = False  # Master flag: Enable/disable vision API rate limiting
 # Vision rate limiting parameters (only used if ENABLE_VISION_RATE_LIMITING = True):
 VISION_MAX_CONCURRENT_CALLS = 1     # Max concurrent vision API calls (1 = sequential, higher = more parallel)
-VISION_CALL_DELAY_SECONDS = 5       # Delay between vision API calls
+VISION_MAX_CALLS_PER_MINUTE = 12    # Sliding-window cap on vision API calls per minute
+VISION_AIMD_INCREASE_AFTER = 5      # Successful calls before the concurrency limit grows back by one (halves on each 429)
+# Quota (429) retries: wait max(server retry hint, base * 2^attempt capped at max) plus up to 20% jitter
+VISION_MAX_RETRIES = 10
+VISION_RETRY_BASE_SECONDS = 1.0
+VISION_RETRY_MAX_SECONDS = 30
 
 # 2. Batch Processing Rate Limiting (controls product batching)
 ENABLE_BATCH_PROCESSING = False      # Master flag: Enable/disable batch processing
@@ -43,6 +59,11 @@ ENABLE_BATCH_PROCESSING = False      # Master flag: Enable/disable batch process
 BATCH_SIZE = 1                      # Number of products to process per batch (e.g., 1 product × 2 supermarkets = 2 agents)
 BATCH_DELAY_SECONDS = 60            # Delay in seconds between batches to respect rate limits
 
+# 3. Product Concurrency (controls how many product pipelines run at the same time)
+# Each product pipeline fans out to every supermarket, so with vision rate limiting on
+# the vision call budget is shared across them
+MAX_CONCURRENT_PRODUCTS = max(1, VISION_MAX_CONCURRENT_CALLS // len(TARGET_SUPERMARKETS)) if ENABLE_VISION_RATE_LIMITING else 4
+
 # ============================================================================
 
 
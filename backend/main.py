@@ -1,24 +1,101 @@
 import asyncio
+import itertools
+import shutil
 import sys
 import os
+from operator import attrgetter
 from pathlib import Path
 
 # Add backend directory to sys.path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from config import PRODUCTS_CSV, RESULTS_CSV, TARGET_SUPERMARKETS, BASE_DIR, RESULTS_DIR
-from utils.csv_handler import read_products_csv, write_results_csv
+from utils.csv_handler import read_products_csv, to_product_records, group_products, StreamingResultsWriter
 from utils.display_utils import print_price_comparison
-from agent.price_search_coordinator import create_price_search_pipeline
-from google.adk.runners import InMemoryRunner
+from utils.image_store import get_product_image_path
+from utils.history_tracker import HistoricalPriceTracker
+from tools.vision_price_fetcher import capture_reference_image, close_browser
+from agent.price_search_coordinator import run_product
+from agent.optimization_agent import format_price
+
+def clear_directory(folder):
+    """Empty ``folder`` in place, creating it if it doesn't exist.
+    Files at the top level are unlinked straight from the scandir entries;
+    only nested directories need a recursive removal."""
+    try:
+        entries = os.scandir(folder)
+    except FileNotFoundError:
+        os.makedirs(folder, exist_ok=True)
+        return
+    
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.unlink(entry.path)
+
+# Process-wide session ID source: unique across batches, retries and concurrent runs
+_session_ids = itertools.count(1)
+
+async def process_product(product, session_id, semaphore, results_writer=None):
+    """Capture the reference image and run the full pipeline for one product
+    (a ``ProductRecord``). Both steps hit the network, so the whole thing runs
+    under ``semaphore``. The product's optimization rows go to ``results_writer``
+    (if given) as soon as it finishes. Returns (result_accumulator, optimizer)."""
+    async with semaphore:
+        print(f"   🔎 Processing: {product.product_name}")
+        
+        # Capture reference image from current supermarket (if not already captured)
+        current_supermarket = product.current_supermarket
+        reference_image_path = get_product_image_path(product.product_name, current_supermarket)
+        
+        if not reference_image_path:
+            print(f"📸 Capturing reference image from {current_supermarket}...")
+            reference_image_path = await capture_reference_image(current_supermarket, product.product_name)
+        else:
+            print(f"✅ Using existing reference image: {reference_image_path}")
+        
+        # Run the pipeline for this product WITH reference image
+        result_accumulator, optimizer = await run_product(
+            product.data,
+            TARGET_SUPERMARKETS,
+            session_id=session_id,  # Unique session ID per concurrent run
+            reference_image_path=reference_image_path,  # Pass reference for visual matching
+            safe_product_name=product.safe_name
+        )
+        
+        # Repeated CSV rows get their own result rows, each with its own current prices
+        if product.duplicates:
+            optimizer.add_duplicate_results(product.duplicates)
+        
+        if results_writer and optimizer.optimization_results:
+            results_writer.write_rows(res.to_dict() for res in optimizer.optimization_results)
+        return result_accumulator, optimizer
+
+async def process_products(products, semaphore, results_writer=None):
+    """Run ``process_product`` for every product concurrently.
+    Returns (product, result_accumulator, optimizer) for each product that
+    completed, in input order; failed products are reported and skipped."""
+    outputs = await asyncio.gather(*[
+        process_product(product, str(next(_session_ids)), semaphore, results_writer)
+        for product in products
+    ], return_exceptions=True)
+    
+    completed = []
+    for product, output in zip(products, outputs):
+        if isinstance(output, BaseException):
+            print(f"❌ Error processing {product.product_name}: {output}")
+            continue
+        result_accumulator, optimizer = output
+        completed.append((product, result_accumulator, optimizer))
+    return completed
 
 async def main():
     print("🛒 Starting Multi-Agent Grocery Optimization System...")
     print("🤖 Using ADK ParallelAgent & SequentialAgent Architecture")
     
     # 0. Cleanup Debug Folders and Old Reports
-    import shutil
-    
     debug_folders = [
         BASE_DIR / "debug",
         BASE_DIR / "data/product_images/product_images_from_rest_supermarkets"
@@ -31,35 +108,29 @@ async def main():
     
     print("\n🧹 Cleaning up debug folders and old reports...")
     
-    # Delete old report files
+    # Delete old report files (a missing file is fine, no separate exists() stat)
     for file_path in files_to_delete:
-        if file_path.exists():
-            try:
-                file_path.unlink()
-                print(f"   ✅ Deleted {file_path}")
-            except Exception as e:
-                print(f"   ⚠️ Failed to delete {file_path}: {e}")
+        try:
+            os.unlink(file_path)
+            print(f"   ✅ Deleted {file_path}")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"   ⚠️ Failed to delete {file_path}: {e}")
     
-    # Clean debug folders
+    # Clean debug folders (emptied in place, created if missing)
     for folder in debug_folders:
-        if folder.exists():
-            try:
-                shutil.rmtree(folder)
-                print(f"   ✅ Deleted {folder}")
-            except Exception as e:
-                print(f"   ⚠️ Failed to delete {folder}: {e}")
-        
-        # Recreate empty folder
         try:
-            folder.mkdir(parents=True, exist_ok=True)
-            print(f"   ✨ Recreated {folder}")
+            clear_directory(folder)
+            print(f"   ✅ Cleared {folder}")
         except Exception as e:
-            print(f"   ⚠️ Failed to recreate {folder}: {e}")
+            print(f"   ⚠️ Failed to clear {folder}: {e}")
     
     # 1. Load Data
     print(f"\n📂 Loading products from {PRODUCTS_CSV}...")
     try:
-        products = read_products_csv(PRODUCTS_CSV)
+        # The pipeline batches and counts products, so it needs them all up front
+        products = list(read_products_csv(PRODUCTS_CSV))
     except FileNotFoundError:
         print(f"❌ Error: Products file not found at {PRODUCTS_CSV}")
         return
@@ -70,185 +141,141 @@ async def main():
         print("❌ Error: CSV missing required columns. Expected: product_name, current_regular_price, current_membership_price, current_supermarket")
         return
     
+    # Group repeated rows so each product is searched only once
+    product_groups = group_products(products)
+    if len(product_groups) < len(products):
+        print(f"ℹ️  {len(products) - len(product_groups)} duplicate product rows will reuse the search of their first occurrence.")
+    
+    # Normalize rows once: attribute access + precomputed identifier-safe names (used for agent names)
+    products = to_product_records(product_groups)
+    
     # Import batch processing config and results directory
     # Import batch processing config
-    from config import ENABLE_BATCH_PROCESSING, BATCH_SIZE, BATCH_DELAY_SECONDS
+    from config import ENABLE_BATCH_PROCESSING, BATCH_SIZE, BATCH_DELAY_SECONDS, MAX_CONCURRENT_PRODUCTS
     
     # Ensure results directory exists
     RESULTS_DIR.mkdir(exist_ok=True)
     
-    # Clear previous optimization results
-    print(f"\n🧹 Clearing previous optimization results from {RESULTS_CSV}...")
-    try:
-        # Write just the header row to clear the file
-        with open(RESULTS_CSV, 'w') as f:
-            f.write("product_name,current_supermarket,current_regular_price,current_membership_price,cheapest_supermarket,cheapest_regular_price,cheapest_membership_price,savings_vs_current,saving_cheapest_regular_vs_current_regular,saving_cheapest_regular_vs_current_membership,current_regular_vs_cheapest_membership,saving_cheapest_membership_vs_current_membership\n")
-        print("✅ Previous results cleared")
-    except Exception as e:
-        print(f"⚠️ Could not clear previous results: {e}")
-    
     print("\n🎯 Starting Grocery Optimization Workflow...")
     print("="*60)
     
-    # Determine if batch processing is enabled
-    if ENABLE_BATCH_PROCESSING and len(products) > BATCH_SIZE:
-        print(f"📦 Batch Processing: ENABLED (Batch Size: {BATCH_SIZE} products)")
-        print(f"⏱️  Delay between batches: {BATCH_DELAY_SECONDS}s\n")
+    # Shared limit on concurrently running product pipelines
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_PRODUCTS)
+    
+    # Results CSV is written as each product finishes (replaces any previous results);
+    # the with-block closes it even if a batch fails
+    with StreamingResultsWriter(RESULTS_CSV) as results_writer:
+        # Determine if batch processing is enabled
+        if ENABLE_BATCH_PROCESSING and len(products) > BATCH_SIZE:
+            print(f"📦 Batch Processing: ENABLED (Batch Size: {BATCH_SIZE} products)")
+            print(f"⏱️  Delay between batches: {BATCH_DELAY_SECONDS}s\n")
         
-        # Split products into batches
-        all_search_results = []
-        all_optimization_results = []
-        all_summaries = []
+            # Split products into batches
+            all_search_results = []
+            all_optimization_results = []
+            all_summaries = []
+            all_price_comparisons = {}  # product_name -> comparison table text, reused in the report
         
-        num_batches = (len(products) + BATCH_SIZE - 1) // BATCH_SIZE  # Ceiling division
+            num_batches = (len(products) + BATCH_SIZE - 1) // BATCH_SIZE  # Ceiling division
         
-        for batch_num in range(num_batches):
-            start_idx = batch_num * BATCH_SIZE
-            end_idx = min(start_idx + BATCH_SIZE, len(products))
-            batch_products = products[start_idx:end_idx]
+            for batch_num in range(num_batches):
+                start_idx = batch_num * BATCH_SIZE
+                end_idx = min(start_idx + BATCH_SIZE, len(products))
+                batch_products = products[start_idx:end_idx]
             
-            print(f"\n{'='*60}")
-            print(f"📦 Processing Batch {batch_num + 1}/{num_batches}")
-            print(f"   Products {start_idx + 1}-{end_idx} of {len(products)}")
-            print(f"{'='*60}")
+                print(f"\n{'='*60}")
+                print(f"📦 Processing Batch {batch_num + 1}/{num_batches}")
+                print(f"   Products {start_idx + 1}-{end_idx} of {len(products)}")
+                print(f"{'='*60}")
             
-            # Process each product in the batch sequentially (or could be parallelized further)
-            for product_idx, product in enumerate(batch_products):
-                print(f"   🔎 Processing: {product['product_name']}")
-                
-                # Capture reference image from current supermarket (if not already captured)
-                from tools.vision_price_fetcher import capture_reference_image
-                from utils.image_store import get_product_image_path
-                
-                current_supermarket = product.get('current_supermarket', 'Tesco')
-                reference_image_path = get_product_image_path(product['product_name'], current_supermarket)
-                
-                if not reference_image_path:
-                    print(f"📸 Capturing reference image from {current_supermarket}...")
-                    reference_image_path = await capture_reference_image(current_supermarket, product['product_name'])
-                else:
-                    print(f"✅ Using existing reference image: {reference_image_path}")
-                
-                # Create coordinator for this product WITH reference image
-                coordinator, result_accumulator, optimizer = create_price_search_pipeline(
-                    product,
-                    TARGET_SUPERMARKETS,
-                    reference_image_path=reference_image_path  # Pass reference for visual matching
-                )
-                runner = InMemoryRunner(agent=coordinator)
-                
-                # Use unique session ID for each product to prevent data overwriting
-                product_session_id = f"product_{batch_num}_{product_idx}"
-                
-                # Run the pipeline for this product
-                await runner.run_debug(
-                    user_messages=f"Find best price for {product['product_name']}",
-                    user_id="main_user",
-                    session_id=product_session_id,  # Unique session ID
-                    verbose=True
-                )
-                
-                # Collect results from result_accumulator (populated by VisionAgents)
-                product_search_results = result_accumulator  # This is where VisionAgents store their results
+                # Process the products in the batch concurrently
+                batch_outputs = await process_products(batch_products, semaphore, results_writer)
+            
+                for product, result_accumulator, optimizer in batch_outputs:
+                    # Collect results from result_accumulator (populated by VisionAgents)
+                    product_search_results = result_accumulator  # This is where VisionAgents store their results
                 
-                # Optimization recommendation and data
-                # DIRECT ACCESS FROM OPTIMIZER INSTANCE (Bypassing session state issues)
-                recommendation = optimizer.final_summary
-                optimization_data = optimizer.optimization_results
+                    # Optimization recommendation and data
+                    # DIRECT ACCESS FROM OPTIMIZER INSTANCE (Bypassing session state issues)
+                    recommendation = optimizer.final_summary
+                    optimization_data = optimizer.optimization_results
                 
-                # Store results
-                all_search_results.extend(product_search_results)
-                if recommendation:
-                    # all_optimization_results was storing text summaries, let's keep it for that
-                    # But we need a separate list for the structured data
-                    all_summaries.append(f"Product: {product['product_name']} -> {recommendation}")
+                    # Store results
+                    all_search_results.extend(product_search_results)
+                    if recommendation:
+                        # all_optimization_results was storing text summaries, let's keep it for that
+                        # But we need a separate list for the structured data
+                        all_summaries.append(f"Product: {product.product_name} -> {recommendation}")
                 
-                if optimization_data:
-                    all_optimization_results.extend(optimization_data)
-                    print(f"   ✅ Added {len(optimization_data)} optimization results to collection")
+                    if optimization_data:
+                        all_optimization_results.extend(optimization_data)
+                        print(f"   ✅ Added {len(optimization_data)} optimization results to collection")
                 
-                # Print comparison for this product
-                if product_search_results:
-                    print_price_comparison(product['product_name'], product_search_results)
+                    # Print comparison for this product
+                    if product_search_results:
+                        comparison = print_price_comparison(product.product_name, product_search_results)
+                        # Only products with at least one match get a table in the report
+                        if any(r.get('found') for r in product_search_results):
+                            all_price_comparisons[product.product_name] = comparison
             
-            print(f"\n✅ Batch {batch_num + 1}/{num_batches} completed")
+                print(f"\n✅ Batch {batch_num + 1}/{num_batches} completed")
             
-            # Wait before next batch (except for the last batch)
-            if batch_num < num_batches - 1:
-                print(f"⏳ Waiting {BATCH_DELAY_SECONDS}s before next batch...")
-                await asyncio.sleep(BATCH_DELAY_SECONDS)
+                # Wait before next batch (except for the last batch)
+                if batch_num < num_batches - 1:
+                    print(f"⏳ Waiting {BATCH_DELAY_SECONDS}s before next batch...")
+                    await asyncio.sleep(BATCH_DELAY_SECONDS)
         
-        # Aggregate results
-        results = {
-            'search_results': all_search_results,
-            'optimization_data': all_optimization_results,
-            'summary': "\n\n".join(all_summaries)
-        }
+            # Aggregate results
+            results = {
+                'search_results': all_search_results,
+                'optimization_data': all_optimization_results,
+                'summary': "\n\n".join(all_summaries),
+                'price_comparisons': all_price_comparisons
+            }
         
-    else:
-        # No batch processing - run all products at once (original behavior)
-        if ENABLE_BATCH_PROCESSING:
-            print(f"📦 Batch Processing: ENABLED but skipped (only {len(products)} products, batch size is {BATCH_SIZE})")
         else:
-            print(f"📦 Batch Processing: DISABLED (processing all {len(products)} products at once)\n")
+            # No batch processing - run all products at once (original behavior)
+            if ENABLE_BATCH_PROCESSING:
+                print(f"📦 Batch Processing: ENABLED but skipped (only {len(products)} products, batch size is {BATCH_SIZE})")
+            else:
+                print(f"📦 Batch Processing: DISABLED (processing all {len(products)} products at once)\n")
         
-        search_results = []
-        optimization_data_list = []
-        summaries = []
+            search_results = []
+            optimization_data_list = []
+            summaries = []
+            price_comparisons = {}  # product_name -> comparison table text, reused in the report
 
-        # Process all products sequentially
-        for product in products:
-            print(f"   🔎 Processing: {product['product_name']}")
-            
-            # Capture reference image from current supermarket (if not already captured)
-            from tools.vision_price_fetcher import capture_reference_image
-            from utils.image_store import get_product_image_path
-            
-            current_supermarket = product.get('current_supermarket', 'Tesco')
-            reference_image_path = get_product_image_path(product['product_name'], current_supermarket)
-            
-            if not reference_image_path:
-                print(f"📸 Capturing reference image from {current_supermarket}...")
-                reference_image_path = await capture_reference_image(current_supermarket, product['product_name'])
-            else:
-                print(f"✅ Using existing reference image: {reference_image_path}")
-            
-            coordinator, result_accumulator, optimizer = create_price_search_pipeline(
-                product,
-                TARGET_SUPERMARKETS,
-                reference_image_path=reference_image_path
-            )
-            runner = InMemoryRunner(agent=coordinator)
-            
-            await runner.run_debug(
-                user_messages=f"Find best price for {product['product_name']}",
-                user_id="main_user",
-                verbose=True
-            )
-            
-            # Collect results from result_accumulator (populated by VisionAgents)
-            product_search_results = result_accumulator
+            print(f"\n🚀 Running {len(products)} product pipelines ({MAX_CONCURRENT_PRODUCTS} at a time)...")
+            pipeline_outputs = await process_products(products, semaphore, results_writer)
+        
+            for product, result_accumulator, optimizer in pipeline_outputs:
+                # Collect results from result_accumulator (populated by VisionAgents)
+                product_search_results = result_accumulator
             
-            # Optimization recommendation and data
-            # DIRECT ACCESS FROM OPTIMIZER INSTANCE
-            recommendation = optimizer.final_summary
-            opt_data = optimizer.optimization_results
+                # Optimization recommendation and data
+                # DIRECT ACCESS FROM OPTIMIZER INSTANCE
+                recommendation = optimizer.final_summary
+                opt_data = optimizer.optimization_results
             
-            search_results.extend(product_search_results)
-            if recommendation:
-                summaries.append(recommendation)
-            if opt_data:
-                optimization_data_list.extend(opt_data)
+                search_results.extend(product_search_results)
+                if recommendation:
+                    summaries.append(recommendation)
+                if opt_data:
+                    optimization_data_list.extend(opt_data)
             
-            # Print comparison
-            if product_search_results:
-                print_price_comparison(product['product_name'], product_search_results)
+                # Print comparison
+                if product_search_results:
+                    comparison = print_price_comparison(product.product_name, product_search_results)
+                    # Only products with at least one match get a table in the report
+                    if any(r.get('found') for r in product_search_results):
+                        price_comparisons[product.product_name] = comparison
                 
-        results = {
-            "search_results": search_results,
-            "optimization_data": optimization_data_list,
-            "summary": "\n".join(summaries)
-        }
+            results = {
+                "search_results": search_results,
+                "optimization_data": optimization_data_list,
+                "summary": "\n".join(summaries),
+                "price_comparisons": price_comparisons
+            }
     
     summary = results['summary']
     
@@ -258,78 +285,65 @@ async def main():
     print("="*60)
     
     # Calculate Global Stats (needed for the report, but report prints last)
-    total_potential_savings = 0.0
-    best_switch = None
-    max_saving = -1.0
-    products_with_savings = []
-    
-    for res in results['optimization_data']:
-        try:
-            saving_str = res.get('savings_vs_current', 'N/A')
-            if saving_str != 'N/A':
-                saving_val = float(saving_str.replace('£', ''))
-                if saving_val > 0:
-                    total_potential_savings += saving_val
-                    products_with_savings.append(res)
-                    
-                    if saving_val > max_saving:
-                        max_saving = saving_val
-                        best_switch = res
-        except ValueError:
-            continue
+    # savings_vs_current is already a float (or None), so these are plain numeric passes
+    products_with_savings = [
+        res for res in results['optimization_data']
+        if res.savings_vs_current is not None and res.savings_vs_current > 0
+    ]
+    total_potential_savings = sum(res.savings_vs_current for res in products_with_savings)
+    best_switch = max(products_with_savings, key=attrgetter('savings_vs_current'), default=None)
 
-    # Import RESULTS_DIR to ensure it exists
-    # from config import RESULTS_DIR  <-- Removed redundant import
-    RESULTS_DIR.mkdir(exist_ok=True)
-    
     # 5. Save Results to CSV
-    print(f"\n💾 Saving results to {RESULTS_CSV}...")
-    write_results_csv(RESULTS_CSV, results['optimization_data'])
-    print("✅ Results saved to CSV")
+    # Rows were streamed in as products finished (header only if nothing was found)
+    print(f"\n💾 Saved {results_writer.rows_written} results to {RESULTS_CSV}")
     
     # 6. Update Historical Prices
     print(f"\n📅 Updating historical price tracking...")
-    from utils.history_tracker import HistoricalPriceTracker
     tracker = HistoricalPriceTracker()
     tracker.update_history(PRODUCTS_CSV, results['search_results'])
     print("✅ Historical prices updated")
 
     # Construct the full report string for the MD file
-    md_report = "# 🛒 Grocery Optimization Report\n\n"
+    md_parts = ["# 🛒 Grocery Optimization Report\n\n"]
     
     # 1. Optimization Stats (First as requested)
-    md_report += "## 📊 Optimization Stats\n\n"
-    md_report += f"**💰 GRAND TOTAL POTENTIAL SAVINGS: £{total_potential_savings:.2f}**\n\n"
+    md_parts.append("## 📊 Optimization Stats\n\n")
+    md_parts.append(f"**💰 GRAND TOTAL POTENTIAL SAVINGS: £{total_potential_savings:.2f}**\n\n")
     
     if best_switch:
-        md_report += f"### 🌟 Top Switch\n"
-        md_report += f"- **Product**: {best_switch['product_name']}\n"
-        md_report += f"- **Savings**: {best_switch['savings_vs_current']}\n"
-        md_report += f"- **Switch**: {best_switch['current_supermarket']} ➡️ {best_switch['cheapest_supermarket']}\n\n"
+        md_parts.append(f"### 🌟 Top Switch\n")
+        md_parts.append(f"- **Product**: {best_switch.product_name}\n")
+        md_parts.append(f"- **Savings**: {format_price(best_switch.savings_vs_current)}\n")
+        md_parts.append(f"- **Switch**: {best_switch.current_supermarket} ➡️ {best_switch.cheapest_supermarket}\n\n")
         
     if products_with_savings:
-        md_report += "### 📋 Savings Opportunities\n"
+        md_parts.append("### 📋 Savings Opportunities\n")
         for p in products_with_savings:
-            md_report += f"- **{p['product_name']}**: Save **{p['savings_vs_current']}** ({p['current_supermarket']} ➡️ {p['cheapest_supermarket']})\n"
-            if 'historical_low_warning' in p:
-                md_report += f"  - {p['historical_low_warning']}\n"
+            md_parts.append(f"- **{p.product_name}**: Save **{format_price(p.savings_vs_current)}** ({p.current_supermarket} ➡️ {p.cheapest_supermarket})\n")
+            if p.historical_low_warning:
+                md_parts.append(f"  - {p.historical_low_warning}\n")
     else:
-        md_report += "ℹ️  No savings found compared to your current supermarket prices.\n"
+        md_parts.append("ℹ️  No savings found compared to your current supermarket prices.\n")
     
-    md_report += "\n---\n\n"
+    md_parts.append("\n---\n\n")
     
     # 2. Price Comparisons (New Section)
-    md_report += "## 🏷️ Price Comparisons\n\n"
-    # We need to regenerate these strings since we didn't capture them during the loop
-    # Ideally we would have captured them, but re-generating is safe and easy here
-    for product_res in results['optimization_data']:
-        p_name = product_res['product_name']
-        # Find search results for this product
-        p_search_results = [r for r in results['search_results'] if r.get('product') == p_name]
-        if p_search_results:
-            md_report += "```text\n"
-            md_report += print_price_comparison(p_name, p_search_results)
-            md_report += "```\n\n"
+    # Reuse the comparison tables captured while collecting results;
+    # the section is left out entirely when no product has one.
+    # Duplicate CSV rows share a product name, so each table is listed once
+    comparisons = [
+        results['price_comparisons'][product_name]
+        for product_name in dict.fromkeys(res.product_name for res in results['optimization_data'])
+        if product_name in results['price_comparisons']
+    ]
+    if comparisons:
+        md_parts.append("## 🏷️ Price Comparisons\n\n")
+        for comparison in comparisons:
+            md_parts.append("```text\n")
+            md_parts.append(comparison)
+            md_parts.append("```\n\n")
+
+    md_report = "".join(md_parts)
 
     # Print to terminal (keep original behavior - still showing detailed summaries)
     print("\n" + "="*60)
@@ -343,15 +357,15 @@ async def main():
     print(f"\n💰 GRAND TOTAL POTENTIAL SAVINGS: £{total_potential_savings:.2f}")
     
     if best_switch:
-        print(f"🌟 TOP SWITCH: {best_switch['product_name']}")
-        print(f"   Save {best_switch['savings_vs_current']} by switching to {best_switch['cheapest_supermarket']}")
+        print(f"🌟 TOP SWITCH: {best_switch.product_name}")
+        print(f"   Save {format_price(best_switch.savings_vs_current)} by switching to {best_switch.cheapest_supermarket}")
         
     if products_with_savings:
         print(f"\n📋 FOUND {len(products_with_savings)} OPPORTUNITIES TO SAVE:")
         for p in products_with_savings:
-            print(f"   • {p['product_name']}: Save {p['savings_vs_current']} ({p['current_supermarket']} -> {p['cheapest_supermarket']})")
-            if 'historical_low_warning' in p:
-                print(f"     {p['historical_low_warning']}")
+            print(f"   • {p.product_name}: Save {format_price(p.savings_vs_current)} ({p.current_supermarket} -> {p.cheapest_supermarket})")
+            if p.historical_low_warning:
+                print(f"     {p.historical_low_warning}")
     else:
         print("\nℹ️  No savings found compared to your current supermarket prices.")
 
@@ -360,11 +374,23 @@ async def main():
     # Save the MD report to backend/results/
     report_path = RESULTS_DIR / "OPTIMIZATION_REPORT.md"
     print(f"\n📄 Saving detailed report to {report_path}...")
-    with open(report_path, "w") as f:
-        f.write(md_report)
+    report_path.write_bytes(md_report.encode("utf-8"))
     print("✅ Report saved")
     
     print("\n✅ Done!")
 
+async def run():
+    """Run the workflow, then shut down the shared Playwright browser."""
+    try:
+        await main()
+    finally:
+        await close_browser()
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    # uvloop (libuv-based event loop) cuts per-await overhead when installed
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(run())
+    else:
+        uvloop.run(run())
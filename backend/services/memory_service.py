@@ -1,21 +1,79 @@
-import pandas as pd
+import csv
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import glob
+import math
 import os
 
+# One history record: (date, price, price_type)
+PriceRecord = Tuple[str, float, str]
+
 class HistoryCSVMemoryService:
     """
     A memory service that reads directly from the historical price CSVs.
     It acts as a read-only interface to the 'History' data.
     """
-    
+
     def __init__(self, history_dir: str = None):
         if history_dir is None:
             from config import BASE_DIR
             history_dir = str(BASE_DIR / "data/history")
         self.history_dir = Path(history_dir)
-        
+        # Parsed history per CSV: {path: (mtime_ns, supermarket, {lower-cased product key: [records]})}
+        # A file is only re-read when its mtime changes
+        self._index: Dict[Path, Tuple[int, str, Dict[str, List[PriceRecord]]]] = {}
+
+    @staticmethod
+    def _parse_history_file(csv_file: Path) -> Dict[str, List[PriceRecord]]:
+        """
+        Parses one history CSV into {lower-cased product key: [(date, price, type), ...]}.
+        Row keys look like "Name - Regular" / "Name - Membership"; empty or invalid prices are skipped.
+        """
+        products = {}
+        with open(csv_file, mode='r', encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return products
+            product_col = header.index('Product')
+            # All price columns (excluding 'Product')
+            date_cols = [(i, c) for i, c in enumerate(header) if i != product_col]
+
+            for row in reader:
+                if len(row) <= product_col:
+                    continue
+                row_name = row[product_col]
+                price_type = "Membership" if "Membership" in row_name else "Regular"
+
+                records = products.setdefault(row_name.lower(), [])
+                for i, date_col in date_cols:
+                    if i >= len(row):
+                        continue
+                    # Check if valid number (NaN fails the > 0 check)
+                    try:
+                        price = float(row[i])
+                    except ValueError:
+                        continue
+                    if price > 0:
+                        records.append((date_col, price, price_type))
+        return products
+
+    def _refresh_index(self, csv_files: List[Path]) -> None:
+        """Brings the in-memory index up to date with ``csv_files``, re-reading only changed files."""
+        for stale in set(self._index) - set(csv_files):
+            del self._index[stale]
+
+        for csv_file in csv_files:
+            supermarket = csv_file.stem.replace("history_", "")
+            try:
+                mtime = csv_file.stat().st_mtime_ns
+                cached = self._index.get(csv_file)
+                if cached is None or cached[0] != mtime:
+                    self._index[csv_file] = (mtime, supermarket, self._parse_history_file(csv_file))
+            except Exception as e:
+                print(f"⚠️ Error reading history for {supermarket}: {e}")
+                self._index.pop(csv_file, None)
+
     def get_product_history(self, product_name: str) -> str:
         """
         Scans all history CSVs to find the price history for a specific product.
@@ -23,57 +81,37 @@ class HistoryCSVMemoryService:
         """
         if not self.history_dir.exists():
             return "No price history available yet."
-            
+
         csv_files = list(self.history_dir.glob("history_*.csv"))
         if not csv_files:
             return "No price history files found."
-            
-        lowest_price = float('inf')
+
+        self._refresh_index(csv_files)
+
+        lowest_price = math.inf
         lowest_details = None
-        
-        found_records = []
-        
+
+        # We look for partial matches because the row key is "Name - Regular" or "Name - Membership"
+        needle = product_name.lower()
         for csv_file in csv_files:
-            supermarket = csv_file.stem.replace("history_", "")
-            try:
-                df = pd.read_csv(csv_file)
-                # Filter for rows containing the product name
-                # We look for partial matches because the row key is "Name - Regular" or "Name - Membership"
-                product_rows = df[df['Product'].str.contains(product_name, case=False, na=False)]
-                
-                if product_rows.empty:
-                    continue
-                    
-                for _, row in product_rows.iterrows():
-                    row_name = row['Product']
-                    price_type = "Membership" if "Membership" in row_name else "Regular"
-                    
-                    # Get all price columns (excluding 'Product')
-                    price_cols = [c for c in df.columns if c != 'Product']
-                    
-                    for date_col in price_cols:
-                        price_val = row[date_col]
-                        # Check if valid number
-                        try:
-                            price = float(price_val)
-                            if pd.notna(price) and price > 0:
-                                found_records.append(f"£{price:.2f} at {supermarket} ({price_type}) on {date_col}")
-                                
-                                if price < lowest_price:
-                                    lowest_price = price
-                                    lowest_details = {
-                                        "price": price,
-                                        "supermarket": supermarket,
-                                        "date": date_col,
-                                        "type": price_type
-                                    }
-                        except (ValueError, TypeError):
-                            continue
-                            
-            except Exception as e:
-                print(f"⚠️ Error reading history for {supermarket}: {e}")
+            entry = self._index.get(csv_file)
+            if entry is None:
                 continue
-                
+            _, supermarket, products = entry
+
+            for product_key, records in products.items():
+                if needle not in product_key:
+                    continue
+                for date_col, price, price_type in records:
+                    if price < lowest_price:
+                        lowest_price = price
+                        lowest_details = {
+                            "price": price,
+                            "supermarket": supermarket,
+                            "date": date_col,
+                            "type": price_type
+                        }
+
         if lowest_details:
             return f"Historical Low: £{lowest_details['price']:.2f} at {lowest_details['supermarket']} ({lowest_details['type']}) on {lowest_details['date']}."
         else:
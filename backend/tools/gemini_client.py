@@ -0,0 +1,25 @@
+"""
+Shared Gemini setup for the vision tools.
+Configures the API key once and exposes a single vision model, so the price
+fetcher and the image comparator reuse the same client (and share quota).
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import google.generativeai as genai
+from dotenv import load_dotenv
+
+# Add backend directory to path to import config
+sys.path.append(str(Path(__file__).parent.parent))
+from config import VISION_MODEL
+
+load_dotenv()
+_api_key = os.environ.get("GOOGLE_API_KEY")
+if not _api_key:
+    raise ValueError("GOOGLE_API_KEY not found in environment variables (add it to your .env file)")
+genai.configure(api_key=_api_key)
+
+# Initialize vision model using configured model
+vision_model = genai.GenerativeModel(VISION_MODEL)
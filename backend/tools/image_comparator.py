@@ -3,20 +3,57 @@ Gemini-powered image comparison for visual product matching.
 Compares two product images to determine if they represent the same product.
 """
 
+import asyncio
 import base64
-import os
+import json
+import re
 from typing import Dict
-import google.generativeai as genai
-from PIL import Image
 from io import BytesIO
 
-# Configure Gemini API
-from dotenv import load_dotenv
-load_dotenv()
-genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+from config import VISION_MAX_RETRIES
+# Use the same vision model as the price fetcher (shared client and quota),
+# and its backoff so concurrent comparisons hitting a 429 don't retry in lockstep
+from tools.gemini_client import vision_model
+from tools.vision_price_fetcher import _backoff_seconds, _retry_after_seconds
 
-# Use Gemini 2.0 Flash for image analysis (same as vision API to share quota)
-vision_model = genai.GenerativeModel('gemini-2.0-flash')
+# Ask for a bare JSON response (no markdown fences)
+JSON_GENERATION_CONFIG = {"response_mime_type": "application/json"}
+
+# Fallback in case the model still wraps its answer in a ``` fence
+# (same pattern as the price fetcher: the closing fence may be missing)
+_FENCE_RE = re.compile(r"^\s*```[a-zA-Z]*\s*(.*?)\s*(?:```\s*)?$", re.DOTALL)
+
+
+def _is_rate_limit_error(error: Exception) -> bool:
+    """True for quota / rate-limit errors (HTTP 429), which are worth retrying."""
+    from google.api_core import exceptions
+    if isinstance(error, exceptions.ResourceExhausted):
+        return True
+    message = str(error).lower()
+    return "429" in message or "quota" in message or "rate limit" in message
+
+
+# Leading bytes of the image formats Gemini accepts as raw blobs
+_IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+)
+
+
+def _image_part(image_bytes: bytes):
+    """
+    Build a Gemini content part for an encoded image without decoding it.
+    Known formats are sent as raw bytes; anything else goes through Pillow.
+    """
+    for signature, mime_type in _IMAGE_SIGNATURES:
+        if image_bytes.startswith(signature):
+            return {"mime_type": mime_type, "data": image_bytes}
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return {"mime_type": "image/webp", "data": image_bytes}
+    
+    from PIL import Image
+    return Image.open(BytesIO(image_bytes))
 
 
 async def compare_product_images(
@@ -40,9 +77,9 @@ async def compare_product_images(
         }
     """
     try:
-        # Convert bytes to PIL Images
-        ref_img = Image.open(BytesIO(reference_image))
-        cand_img = Image.open(BytesIO(candidate_image))
+        # Send the encoded images as-is (no Pillow decode per comparison)
+        ref_img = _image_part(reference_image)
+        cand_img = _image_part(candidate_image)
         
         # Prepare prompt
         prompt = f"""Compare these two product images. Are they the SAME product?
@@ -71,20 +108,30 @@ Respond in STRICT JSON format:
 First image: Reference product
 Second image: Candidate product"""
 
-        # Call Gemini with both images
-        response = vision_model.generate_content([prompt, ref_img, cand_img])
+        # Call Gemini with both images, backing off on rate limits
+        # (in a worker thread, so concurrent comparisons don't block the event loop)
+        for attempt in range(VISION_MAX_RETRIES):
+            try:
+                response = await asyncio.to_thread(
+                    vision_model.generate_content,
+                    [prompt, ref_img, cand_img],
+                    generation_config=JSON_GENERATION_CONFIG
+                )
+                break
+            except Exception as e:
+                if attempt == VISION_MAX_RETRIES - 1 or not _is_rate_limit_error(e):
+                    raise
+                wait_time = _backoff_seconds(attempt, _retry_after_seconds(e))
+                print(f"   ⚠️ Quota exceeded comparing images, waiting {wait_time:.1f}s...")
+                await asyncio.sleep(wait_time)
         result_text = response.text.strip()
         
-        # Clean markdown fences if present
-        if result_text.startswith("```"):
-            lines = result_text.split("\n")
-            lines = lines[1:]  # Remove first line
-            if lines and lines[-1].strip() == "```":
-                lines = lines[:-1]  # Remove last line
-            result_text = "\n".join(lines).strip()
+        # Clean markdown fences if present (shouldn't happen in JSON mode)
+        fenced = _FENCE_RE.match(result_text)
+        if fenced:
+            result_text = fenced.group(1)
         
         # Parse JSON response
-        import json
         result = json.loads(result_text)
         
         # Validate response structure
@@ -110,17 +157,13 @@ def compare_product_images_sync(
     product_description: str
 ) -> Dict:
     """Synchronous version of compare_product_images"""
-    import asyncio
     try:
-        loop = asyncio.get_event_loop()
+        asyncio.get_running_loop()
     except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    
-    if loop.is_running():
-        # If already in async context, use the async version directly
-        raise RuntimeError("Use compare_product_images (async) when already in async context")
+        # No loop running in this thread - safe to run one for this call
+        return asyncio.run(
+            compare_product_images(reference_image, candidate_image, product_description)
+        )
     
-    return loop.run_until_complete(
-        compare_product_images(reference_image, candidate_image, product_description)
-    )
+    # If already in async context, use the async version directly
+    raise RuntimeError("Use compare_product_images (async) when already in async context")
@@ -9,123 +9,356 @@ Uses Gemini's vision capabilities to:
 """
 
 import asyncio
-import base64
+import atexit
+import hashlib
+import json
 import os
+import random
+import re
 import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from pathlib import Path
 
-import google.generativeai as genai
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from playwright.async_api import async_playwright
+from google.api_core import exceptions as google_exceptions
+from PIL import Image
 
 # Add backend directory to path to import config
 sys.path.append(str(Path(__file__).parent.parent))
 from config import (
-    VISION_MODEL,
     ENABLE_VISION_RATE_LIMITING,
     VISION_MAX_CONCURRENT_CALLS,
-    VISION_CALL_DELAY_SECONDS,
+    VISION_MAX_CALLS_PER_MINUTE,
+    VISION_AIMD_INCREASE_AFTER,
+    VISION_MAX_RETRIES,
+    VISION_RETRY_BASE_SECONDS,
+    VISION_RETRY_MAX_SECONDS,
+    FAST_FUSED_CROP,
+    VISION_HEADLESS,
+    DEBUG_DUMP_SCREENSHOTS,
+    DEBUG_DESCRIBE_SEARCH_BOX,
     BASE_DIR
 )
-from utils.image_store import save_product_image, get_product_image
+from utils.image_store import save_product_image_async, get_product_image
 from utils.name_simplifier import simplify_product_name
 
-import cv2
-import numpy as np
 from difflib import SequenceMatcher
+from functools import lru_cache
 from typing import Optional
 
+# Gemini responses are parsed with orjson when it is installed (stdlib json otherwise);
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so except clauses work for both
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
+
+
+def _dumps_indented(obj) -> str:
+    """Pretty-print ``obj`` as JSON for a prompt (2-space indent, orjson when available)."""
+    if hasattr(_json, "OPT_INDENT_2"):
+        return _json.dumps(obj, option=_json.OPT_INDENT_2).decode()
+    return json.dumps(obj, indent=2)
+
+# Optional ```json ... ``` markdown fence around a Gemini answer (closing fence may be missing)
+_FENCE_RE = re.compile(r"^\s*```[a-zA-Z]*\s*(.*?)\s*(?:```\s*)?$", re.DOTALL)
+
+
+def _extract_json(text: str) -> str:
+    """Return the JSON body of a Gemini answer, without surrounding markdown fences."""
+    fenced = _FENCE_RE.match(text)
+    return (fenced.group(1) if fenced else text).strip()
+
 load_dotenv()
-genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
 
-# Initialize vision model using configured model
-vision_model = genai.GenerativeModel(VISION_MODEL)
+# Shared vision model (API key is configured once in tools.gemini_client)
+from tools.gemini_client import vision_model
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Async context manager limiting concurrent vision calls with AIMD backpressure:
+    the limit halves on every quota error and grows back by one after
+    ``increase_after`` consecutive successes, up to ``max_size``.
+    """
+
+    def __init__(self, max_size: int, increase_after: int = VISION_AIMD_INCREASE_AFTER):
+        self._max_size = max(1, max_size)
+        self._size = self._max_size
+        self._increase_after = increase_after
+        self._in_flight = 0
+        self._successes = 0
+        self._condition = asyncio.Condition()
 
-# Initialize semaphore for vision API rate limiting
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self._size)
+            self._in_flight += 1
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        self._successes += 1
+        if self._successes >= self._increase_after and self._size < self._max_size:
+            self._size += 1
+            self._successes = 0
+
+    def on_rate_limited(self):
+        self._size = max(1, self._size // 2)
+        self._successes = 0
+
+
+class RateLimiter:
+    """Sliding-window limiter: at most ``rpm`` acquisitions in any 60 second window."""
+
+    def __init__(self, rpm: int):
+        self._rpm = max(1, rpm)
+        self._calls: deque[float] = deque()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._calls and now - self._calls[0] >= 60:
+                    self._calls.popleft()
+                if len(self._calls) < self._rpm:
+                    break
+                await asyncio.sleep(self._calls[0] + 60 - now)
+            self._calls.append(time.monotonic())
+
+
+# Initialize limiter for vision API rate limiting
 # This limits concurrent vision API calls to avoid quota errors
 # Set ENABLE_VISION_RATE_LIMITING=False in config.py to disable
-_vision_api_semaphore = asyncio.Semaphore(VISION_MAX_CONCURRENT_CALLS) if ENABLE_VISION_RATE_LIMITING else None
+_vision_api_semaphore = AdaptiveConcurrencyLimiter(VISION_MAX_CONCURRENT_CALLS) if ENABLE_VISION_RATE_LIMITING else None
+_vision_rate_limiter = RateLimiter(VISION_MAX_CALLS_PER_MINUTE) if ENABLE_VISION_RATE_LIMITING else None
 
 
-async def take_screenshot(page) -> tuple[bytes, str]:
-    """Take a screenshot and return bytes + base64 encoding"""
-    screenshot_bytes = await page.screenshot(timeout=60000)
-    base64_image = base64.b64encode(screenshot_bytes).decode()
-    return screenshot_bytes, base64_image
+# Blocking Gemini SDK calls get their own threads, so slow API round-trips never
+# starve the default executor (or the image executor below)
+_GEMINI_EXECUTOR = ThreadPoolExecutor(
+    max_workers=max(8, VISION_MAX_CONCURRENT_CALLS * 2), thread_name_prefix="gemini"
+)
+atexit.register(_GEMINI_EXECUTOR.shutdown, wait=False)
+
+
+# Transient provider errors worth retrying with backoff; ResourceExhausted (429) also
+# shrinks the concurrency limit and honours the server's retry hint
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+    asyncio.TimeoutError,
+)
+# Errors a retry can't fix (bad request, bad key, unknown model) - fail fast
+UNRECOVERABLE_ERRORS = (
+    google_exceptions.InvalidArgument,
+    google_exceptions.PermissionDenied,
+    google_exceptions.NotFound,
+)
+
+
+def _retry_after_seconds(error: Exception) -> float:
+    """Server-suggested wait from a quota error (Retry-After header or RetryInfo), or 0."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        try:
+            return float(headers.get("retry-after", 0))
+        except (TypeError, ValueError):
+            pass
+    for detail in getattr(error, "details", None) or []:
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+    return 0.0
+
+
+def _backoff_seconds(attempt: int, server_hint: float = 0.0) -> float:
+    """Exponential backoff honouring the server hint, with up to 20% positive jitter."""
+    wait = max(server_hint, min(VISION_RETRY_MAX_SECONDS, VISION_RETRY_BASE_SECONDS * 2 ** attempt))
+    return wait * (1 + random.uniform(0, 0.2))
+
+
+# Screenshots are viewport-only JPEGs (roughly 10x smaller than PNG; Gemini doesn't need
+# lossless input) taken at a reduced viewport
+SCREENSHOT_VIEWPORT = {'width': 1280, 'height': 800}
+SCREENSHOT_JPEG_QUALITY = 75
+
+
+async def take_screenshot(page) -> bytes:
+    """Take a JPEG screenshot of the viewport and return its bytes"""
+    return await page.screenshot(
+        type="jpeg", quality=SCREENSHOT_JPEG_QUALITY, full_page=False, timeout=60000
+    )
 
 
 async def ask_vision_model(screenshot_bytes: bytes, prompt: str) -> str:
-    """Ask Gemini to analyze a screenshot"""
-    from PIL import Image
-    
-    # Convert bytes to PIL Image
-    image = Image.open(BytesIO(screenshot_bytes))
+    """Ask Gemini to analyze a screenshot (JPEG bytes from take_screenshot)"""
+    # Upload the encoded screenshot as-is: no PIL decode here and no re-encode in the SDK.
+    # Blob parts are also hashed for the response cache, so asking the same question
+    # about the same screenshot again is served from memory.
+    image = {"mime_type": "image/jpeg", "data": screenshot_bytes}
     
     # Ask Gemini with retry logic
     response_text = await generate_content_with_retry(prompt, image)
     return response_text
 
 
-async def generate_content_with_retry(prompt, image) -> str:
+# Gemini answers for the crop stages, keyed by (image digest, prompt).
+# Re-running a stage on identical pixels (e.g. the simplified-name fallback on the
+# same screenshot) returns the cached answer instead of another API call.
+_vision_response_cache = TTLCache(maxsize=512, ttl=3600)
+
+
+def _image_digest(data) -> str:
+    """Short BLAKE2b digest of encoded image bytes or a decoded PIL image."""
+    if not isinstance(data, (bytes, bytearray, memoryview)):
+        data = data.tobytes()  # decoded PIL image
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+async def generate_content_with_retry(prompt, image, image_digest: Optional[str] = None) -> str:
     """
     Helper to call Gemini with retry logic for rate limits.
     
+    Responses are cached when the image is identifiable: in-memory blob parts are
+    hashed here, other images (PIL) only when the caller passes ``image_digest``.
+    
     When ENABLE_VISION_RATE_LIMITING is True, this function:
-    - Limits concurrent calls using a semaphore
-    - Adds delays between calls to avoid quota errors
+    - Limits concurrent calls (the limit adapts to quota errors)
+    - Keeps calls under VISION_MAX_CALLS_PER_MINUTE (waits only when the budget is spent)
     
     When ENABLE_VISION_RATE_LIMITING is False:
     - Runs at full speed with no artificial delays
     """
-    import time
-    from google.api_core import exceptions
+    if image_digest is None and isinstance(image, dict):
+        image_digest = _image_digest(image["data"])
+    cache_key = (image_digest, prompt) if image_digest else None
+    if cache_key and cache_key in _vision_response_cache:
+        return _vision_response_cache[cache_key]
     
     # Acquire semaphore if rate limiting is enabled
     if _vision_api_semaphore:
         async with _vision_api_semaphore:
-            return await _generate_content_with_retry_impl(prompt, image)
+            text = await _generate_content_with_retry_impl(prompt, image)
     else:
         # No rate limiting - run at full speed
-        return await _generate_content_with_retry_impl(prompt, image)
+        text = await _generate_content_with_retry_impl(prompt, image)
+    
+    if cache_key and text:
+        _vision_response_cache[cache_key] = text
+    return text
 
 
 async def _generate_content_with_retry_impl(prompt, image) -> str:
     """Internal implementation of generate_content with retry logic"""
-    import time
-    from google.api_core import exceptions
-    
-    max_retries = 3
+    max_retries = VISION_MAX_RETRIES
     for attempt in range(max_retries):
         try:
-            # Run the synchronous API call in a thread pool to avoid blocking
-            loop = asyncio.get_event_loop()
+            if _vision_rate_limiter:
+                await _vision_rate_limiter.acquire()
+            
+            # Run the synchronous API call on the Gemini thread pool to avoid blocking
+            loop = asyncio.get_running_loop()
             response = await loop.run_in_executor(
-                None, 
+                _GEMINI_EXECUTOR,
                 lambda: vision_model.generate_content([prompt, image])
             )
             
-            # Add delay after successful call if rate limiting is enabled
-            if ENABLE_VISION_RATE_LIMITING and VISION_CALL_DELAY_SECONDS > 0:
-                await asyncio.sleep(VISION_CALL_DELAY_SECONDS)
+            if _vision_api_semaphore:
+                _vision_api_semaphore.on_success()
             
             return response.text
-        except exceptions.ResourceExhausted:
+        except UNRECOVERABLE_ERRORS as e:
+            print(f"   ⚠️ Gemini error (not retrying): {e}")
+            raise
+        except RETRYABLE_ERRORS as e:
+            rate_limited = isinstance(e, google_exceptions.ResourceExhausted)
+            if rate_limited and _vision_api_semaphore:
+                _vision_api_semaphore.on_rate_limited()
             if attempt < max_retries - 1:
-                wait_time = (attempt + 1) * 20  # 20s, 40s, 60s
-                print(f"   ⚠️ Quota exceeded, waiting {wait_time}s...")
+                wait_time = _backoff_seconds(attempt, _retry_after_seconds(e) if rate_limited else 0.0)
+                reason = "Quota exceeded" if rate_limited else f"Transient Gemini error ({type(e).__name__})"
+                print(f"   ⚠️ {reason}, waiting {wait_time:.1f}s...")
                 await asyncio.sleep(wait_time)
             else:
                 raise
-        except Exception as e:
-            print(f"   ⚠️ Gemini error: {e}")
-            raise
     return ""
 
 
 
 
-async def crop_to_product_image(product_name: str, screenshot_bytes: bytes) -> Optional[bytes]:
+# Image decode/encode/resize runs on its own workers so it never blocks the event loop
+# (Pillow releases the GIL while decoding/encoding, so threads run in parallel without
+# pickling images to another process) and never queues behind Gemini calls on the
+# default executor
+_IMAGE_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="image")
+
+
+async def _run_image_op(fn, *args):
+    """Run a CPU-bound image function on the image executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_IMAGE_EXECUTOR, fn, *args)
+
+
+def _encode_png(image: Image.Image) -> bytes:
+    """Full-resolution PNG bytes for a crop that is kept."""
+    buf = BytesIO()
+    image.save(buf, "PNG")
+    return buf.getvalue()
+
+
+def _decode_screenshot(screenshot_bytes: bytes) -> Image.Image:
+    """Decode a screenshot once into a PIL image."""
+    image = Image.open(BytesIO(screenshot_bytes))
+    image.load()
+    return image
+
+
+def _norm_to_px(value, dim: int) -> int:
+    """Map a Gemini 0-1000 normalized coordinate (or length) onto ``dim`` pixels."""
+    return int(value * dim // 1000)
+
+
+# Crops sent to Gemini are downscaled and JPEG-encoded (saved images stay full-res PNG)
+CROP_UPLOAD_MAX_SIDE = 768
+CROP_UPLOAD_JPEG_QUALITY = 70
+
+
+def _to_jpeg_part(image: Image.Image, max_side: int = CROP_UPLOAD_MAX_SIDE,
+                  quality: int = CROP_UPLOAD_JPEG_QUALITY) -> dict:
+    """
+    Prepare a crop for upload to Gemini: shrink it so the long edge is at
+    most ``max_side`` pixels and encode it as an in-memory JPEG blob part.
+    """
+    # Not thumbnail(): it shrinks in place, and callers keep using the full-res crop
+    # (refine coordinates, saved PNG). reducing_gap does a cheap integer reduce first,
+    # so the resample only touches the already-shrunk pixels.
+    w, h = image.size
+    scale = max_side / max(h, w)
+    if scale < 1:
+        image = image.resize((max(1, int(w * scale)), max(1, int(h * scale))),
+                             Image.Resampling.LANCZOS, reducing_gap=2.0)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    buf = BytesIO()
+    # Single-pass baseline encode (optimize only saves ~1% at this quality)
+    image.save(buf, "JPEG", quality=quality, optimize=False, progressive=False)
+    return {"mime_type": "image/jpeg", "data": buf.getvalue()}
+
+
+async def crop_to_product_image(product_name: str, screenshot_bytes: Optional[bytes] = None,
+                                image: Optional[Image.Image] = None) -> Optional[bytes]:
     """
     Intelligently crop a product package image from a screenshot using Gemini Vision AI.
     
@@ -141,6 +374,8 @@ async def crop_to_product_image(product_name: str, screenshot_bytes: bytes) -> O
     Args:
         product_name: Name of the product to find and crop (e.g., "Ferrero Raffaello 230G")
         screenshot_bytes: Raw bytes of a PNG/JPEG screenshot from a grocery website
+        image: The same screenshot already decoded as a PIL image. When given,
+            ``screenshot_bytes`` is not needed and the screenshot isn't decoded again.
     
     Returns:
         Optional[bytes]: PNG-encoded bytes of the cropped product package image, or None if:
@@ -156,19 +391,26 @@ async def crop_to_product_image(product_name: str, screenshot_bytes: bytes) -> O
     
     Technical Details:
         - Uses Gemini Vision API for product detection and localization
+        - With FAST_FUSED_CROP, first tries a single fused locate + validate call
         - Tries multiple crop strategies (tight, medium, wide) if initial crop fails validation
         - Returns the best validated crop containing the product package
     """
-    from PIL import Image
-    import json
+    # Load screenshot (decoded once; it is sent to Gemini as-is and crops are cut from it)
+    if image is None:
+        image = await _run_image_op(_decode_screenshot, screenshot_bytes)
+    screenshot_image = image
+    img_width, img_height = image.size
+    screenshot_digest = await _run_image_op(
+        _image_digest, screenshot_bytes if screenshot_bytes is not None else image
+    )
     
-    # Load screenshot
-    arr = np.frombuffer(screenshot_bytes, dtype=np.uint8)
-    img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-    img_height, img_width = img.shape[:2]
-    
-    # Convert to PIL Image for Gemini
-    screenshot_image = Image.open(BytesIO(screenshot_bytes))
+    if FAST_FUSED_CROP:
+        print(f"   ⚡ Fused crop: locating and validating '{product_name}' in one call...")
+        fused_bytes = await fused_crop(product_name, screenshot_image, screenshot_digest)
+        if fused_bytes:
+            print(f"   ✅ Fused crop accepted")
+            return fused_bytes
+        print(f"   ⚠️ Fused crop not confident enough, falling back to multi-pass crop")
     
     print(f"   🤖 Using Gemini Vision to locate and crop product package...")
     
@@ -209,17 +451,12 @@ Image dimensions: {img_width}x{img_height} pixels.
 """
     
     try:
-        response_text = await generate_content_with_retry(localization_prompt, screenshot_image)
-        response_text = response_text.strip()
-        
-        # Clean markdown fences
-        if response_text.startswith("```"):
-            response_text = response_text.split("```")[1]
-            if response_text.startswith("json"):
-                response_text = response_text[4:]
-        response_text = response_text.strip()
+        response_text = await generate_content_with_retry(
+            localization_prompt, screenshot_image, image_digest=screenshot_digest
+        )
+        response_text = _extract_json(response_text)
         
-        result = json.loads(response_text)
+        result = _json.loads(response_text)
         
         print(f"   📊 Gemini Analysis:")
         print(f"      Found: {result.get('found', False)}")
@@ -237,8 +474,8 @@ Image dimensions: {img_width}x{img_height} pixels.
         center_x = int(center.get("x", 500))
         
         # Convert to pixels
-        center_x_px = int(center_x / 1000 * img_width)
-        center_y_px = int(center_y / 1000 * img_height)
+        center_x_px = _norm_to_px(center_x, img_width)
+        center_y_px = _norm_to_px(center_y, img_height)
         
         # Create a MEDIUM-LARGE coarse crop around the center (800x800)
         # This is a compromise: large enough to capture product, small enough to reduce noise
@@ -256,12 +493,13 @@ Image dimensions: {img_width}x{img_height} pixels.
         
         print(f"   📐 Coarse crop region (pixels): x={x}, y={y}, width={width}, height={height}")
         
-        # Try multiple zoom levels if validation fails (centered on the padded crop)
+        # Try multiple zoom levels (centered on the padded crop)
         # We use the calculated pixel coordinates as the base
         base_x, base_y, base_w, base_h = x, y, width, height
         zoom_levels = [1.0, 1.2, 0.8] # Normal, zoomed out (more context), zoomed in (tighter)
 
-        for i, zoom in enumerate(zoom_levels):
+        async def _try_zoom(i: int, zoom: float) -> tuple[bool, Optional[bytes]]:
+            """One refine + validate attempt; returns (validated, png_bytes)."""
             print(f"   [Attempt {i+1}/{len(zoom_levels)}] Cropping with zoom {zoom}x...")
             
             # Calculate new dimensions based on zoom
@@ -284,29 +522,25 @@ Image dimensions: {img_width}x{img_height} pixels.
             print(f"   📐 Attempt region: x={x_curr}, y={y_curr}, width={w_curr}, height={h_curr}")
 
             # Perform crop
-            cropped = img[y_curr:y_curr+h_curr, x_curr:x_curr+w_curr]
+            cropped = image.crop((x_curr, y_curr, x_curr+w_curr, y_curr+h_curr))
 
-            if cropped.size == 0:
+            if cropped.width == 0 or cropped.height == 0:
                 print(f"   ❌ Crop resulted in empty image at zoom {zoom}x")
-                continue
-
-            # Encode to PNG
-            _, buffer = cv2.imencode(".png", cropped)
-            crop_bytes = buffer.tobytes()
+                return False, None
 
             # --- STEP 2: REFINE CROP (Two-Pass Strategy) ---
             print(f"   🔨 Refinement: Optimizing crop for '{product_name}'...")
-            refined_bytes = await refine_crop(product_name, crop_bytes)
+            refined = await refine_crop(product_name, cropped)
             
-            if refined_bytes:
+            if refined is not None:
                 print(f"   ✨ Refinement successful")
-                final_bytes = refined_bytes
+                final_img = refined
             else:
                 print(f"   ⚠️ Refinement failed, using original crop")
-                final_bytes = crop_bytes
+                final_img = cropped
             
             # --- STEP 3: VALIDATION ---
-            crop_image = Image.open(BytesIO(final_bytes))
+            crop_image = await _run_image_op(_to_jpeg_part, final_img)
             
             validation_prompt = f"""
 Look at this cropped image.
@@ -324,17 +558,13 @@ Be strict: the image must clearly show the actual physical package/container.
 """
             
             validation_response_text = await generate_content_with_retry(validation_prompt, crop_image)
-            validation_text = validation_response_text.strip()
-            
-            # Clean markdown fences
-            if validation_text.startswith("```"):
-                lines = validation_text.split("\n")
-                lines = lines[1:]
-                if lines and lines[-1].strip() == "```":
-                    lines = lines[:-1]
-                validation_text = "\n".join(lines).strip()
+            validation_text = _extract_json(validation_response_text)
             
-            validation = json.loads(validation_text)
+            try:
+                validation = _json.loads(validation_text)
+            except _json.JSONDecodeError as e:
+                print(f"   ❌ Failed to parse validation at zoom {zoom}x: {e}")
+                return False, None
             
             contains_package = validation.get("contains_package", False)
             val_confidence = validation.get("confidence", 0.0)
@@ -345,15 +575,28 @@ Be strict: the image must clearly show the actual physical package/container.
             
             if contains_package and val_confidence >= 0.75:
                 print(f"   ✅ Successfully cropped and validated product package")
-                return final_bytes
-            else:
-                print(f"   ❌ Validation failed at zoom {zoom}x - crop doesn't contain a valid package")
+                # Encode the full-res PNG only for the crop we actually keep
+                return True, await _run_image_op(_encode_png, final_img)
+            print(f"   ❌ Validation failed at zoom {zoom}x - crop doesn't contain a valid package")
+            return False, None
+
+        # Attempts are independent, so run them concurrently and keep the first
+        # one that validates (API concurrency is still capped by the vision semaphore)
+        tasks = [asyncio.create_task(_try_zoom(i, zoom)) for i, zoom in enumerate(zoom_levels)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                ok, final_bytes = await next_done
+                if ok:
+                    return final_bytes
+        finally:
+            for task in tasks:
+                task.cancel()
         
         # If all zoom levels fail
         print(f"   ❌ All cropping attempts failed validation")
         return None
             
-    except json.JSONDecodeError as e:
+    except _json.JSONDecodeError as e:
         print(f"   ❌ Failed to parse Gemini response: {e}")
         print(f"      Response: {response_text[:200]}...")
         return None
@@ -364,21 +607,99 @@ Be strict: the image must clearly show the actual physical package/container.
         return None
 
 
-async def refine_crop(product_name: str, image_bytes: bytes) -> Optional[bytes]:
+async def fused_crop(product_name: str, screenshot_image: Image.Image,
+                     screenshot_digest: Optional[str] = None) -> Optional[bytes]:
+    """
+    Single-call crop: ask Gemini for the tight package box and a validation verdict
+    in one response. Returns PNG bytes of the crop when the package is confirmed
+    with confidence >= 0.75, otherwise None (the caller runs the multi-pass flow).
+    """
+    img_width, img_height = screenshot_image.size
+    
+    fused_prompt = f"""
+You are cropping a product package IMAGE out of a grocery website screenshot.
+
+PRODUCT TO FIND: "{product_name}"
+
+Work through these steps, then answer once:
+1. Find the product tile for "{product_name}" (ignore other products).
+2. Draw a TIGHT bounding box around the PRODUCT PACKAGE PHOTO ONLY (box, bottle, bag, container, wrapper).
+   EXCLUDE website text (product name, price, ratings), buttons and other UI elements.
+   INCLUDE the ENTIRE package - do not cut off any edges of the product photo.
+3. Check your box: does it clearly show the physical package for "{product_name}"?
+   List anything unwanted left inside the box.
+
+Respond with ONLY a JSON object:
+{{
+    "found": true or false,
+    "crop_region": {{
+        "ymin": top edge (0-1000),
+        "xmin": left edge (0-1000),
+        "ymax": bottom edge (0-1000),
+        "xmax": right edge (0-1000)
+    }},
+    "contains_package": true or false,
+    "confidence": 0.0 to 1.0,
+    "issues": ["ui_text", "price", "whitespace", "other_product", ...] or [],
+    "reasoning": "brief explanation"
+}}
+
+Use NORMALIZED coordinates (0-1000) where 0,0 is top-left.
+Image dimensions: {img_width}x{img_height} pixels.
+Be strict: only report contains_package=true if the box clearly shows the actual package and no website text.
+"""
+    
+    # Any malformed answer (non-dict, string confidence, null coordinates) means
+    # no crop, so the caller's multi-pass fallback still runs
+    try:
+        text = await generate_content_with_retry(fused_prompt, screenshot_image, image_digest=screenshot_digest)
+        text = _extract_json(text)
+        
+        result = _json.loads(text)
+        if not isinstance(result, dict):
+            raise ValueError(f"expected a JSON object, got {type(result).__name__}")
+        
+        confidence = float(result.get("confidence") or 0)
+        print(f"   ✓ Fused: Found={result.get('found', False)}, Package={result.get('contains_package', False)}, "
+              f"Confidence={confidence:.2f}, Issues={result.get('issues', [])}")
+        if not (result.get("found") and result.get("contains_package") and confidence >= 0.75):
+            return None
+        if result.get("issues"):
+            return None
+        
+        crop = result.get("crop_region")
+        if not isinstance(crop, dict):
+            return None
+        ymin = int(crop.get("ymin", 0))
+        xmin = int(crop.get("xmin", 0))
+        ymax = int(crop.get("ymax", 1000))
+        xmax = int(crop.get("xmax", 1000))
+        
+        # Convert to pixels
+        x = max(0, _norm_to_px(xmin, img_width))
+        y = max(0, _norm_to_px(ymin, img_height))
+        w = min(img_width - x, _norm_to_px(xmax - xmin, img_width))
+        h = min(img_height - y, _norm_to_px(ymax - ymin, img_height))
+    except Exception as e:
+        print(f"   ⚠️ Fused crop failed: {e}")
+        return None
+    
+    if w < 10 or h < 10:
+        return None
+    
+    return await _run_image_op(_encode_png, screenshot_image.crop((x, y, x+w, y+h)))
+
+
+async def refine_crop(product_name: str, img: Image.Image) -> Optional[Image.Image]:
     """
     Pass 2: Take a rough crop and ask Gemini to crop it TIGHTLY to the product package.
     This eliminates surrounding whitespace or other elements.
+    Works on a decoded PIL image and returns the refined crop (or None).
     """
-    from PIL import Image
-    import json
-    
     try:
-        # Load image
-        arr = np.frombuffer(image_bytes, dtype=np.uint8)
-        img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-        img_height, img_width = img.shape[:2]
+        img_width, img_height = img.size
         
-        pil_image = Image.open(BytesIO(image_bytes))
+        refine_image = await _run_image_op(_to_jpeg_part, img)
         
         refine_prompt = f"""
 You are refining a product image crop.
@@ -415,17 +736,10 @@ Respond with ONLY a JSON object:
 
 Use NORMALIZED coordinates (0-1000) relative to this image.
 """
-        text = await generate_content_with_retry(refine_prompt, pil_image)
-        text = text.strip()
-        
-        # Clean markdown
-        if text.startswith("```"):
-            text = text.split("```")[1]
-            if text.startswith("json"):
-                text = text[4:]
-        text = text.strip()
+        text = await generate_content_with_retry(refine_prompt, refine_image)
+        text = _extract_json(text)
         
-        result = json.loads(text)
+        result = _json.loads(text)
         
         if not result.get("found", False):
             return None
@@ -437,10 +751,10 @@ Use NORMALIZED coordinates (0-1000) relative to this image.
         xmax = int(crop.get("xmax", 1000))
         
         # Convert to pixels
-        x = int(xmin / 1000 * img_width)
-        y = int(ymin / 1000 * img_height)
-        w = int((xmax - xmin) / 1000 * img_width)
-        h = int((ymax - ymin) / 1000 * img_height)
+        x = _norm_to_px(xmin, img_width)
+        y = _norm_to_px(ymin, img_height)
+        w = _norm_to_px(xmax - xmin, img_width)
+        h = _norm_to_px(ymax - ymin, img_height)
         
         # Add 5% padding to ensure we don't cut off edges
         padding_x = int(w * 0.05)
@@ -456,11 +770,7 @@ Use NORMALIZED coordinates (0-1000) relative to this image.
             return None
             
         # Crop
-        refined = img[y:y+h, x:x+w]
-        
-        # Encode
-        _, buffer = cv2.imencode(".png", refined)
-        refined_bytes = buffer.tobytes()
+        refined = img.crop((x, y, x+w, y+h))
         
         # --- DOUBLE CHECK: Verify and Clean ---
         # The user specifically requested a "double check" to remove UI/text.
@@ -497,17 +807,11 @@ Use NORMALIZED coordinates (0-1000) relative to THIS image.
 """
         
         try:
-            pil_refined = Image.open(BytesIO(refined_bytes))
-            clean_text = await generate_content_with_retry(clean_prompt, pil_refined)
-            clean_text = clean_text.strip()
-            
-            if clean_text.startswith("```"):
-                clean_text = clean_text.split("```")[1]
-                if clean_text.startswith("json"):
-                    clean_text = clean_text[4:]
-            clean_text = clean_text.strip()
+            qa_image = await _run_image_op(_to_jpeg_part, refined)
+            clean_text = await generate_content_with_retry(clean_prompt, qa_image)
+            clean_text = _extract_json(clean_text)
             
-            clean_result = json.loads(clean_text)
+            clean_result = _json.loads(clean_text)
             print(f"   🕵️ QA Result: {clean_result.get('status')} - {clean_result.get('reason')}")
             
             if clean_result.get("status") == "DIRTY":
@@ -519,28 +823,26 @@ Use NORMALIZED coordinates (0-1000) relative to THIS image.
                 cx_max = int(clean_box.get("xmax", 1000))
                 
                 # Convert to pixels (relative to the refined crop)
-                ref_h, ref_w = refined.shape[:2]
+                ref_w, ref_h = refined.size
                 
-                nx = int(cx_min / 1000 * ref_w)
-                ny = int(cy_min / 1000 * ref_h)
-                nw = int((cx_max - cx_min) / 1000 * ref_w)
-                nh = int((cy_max - cy_min) / 1000 * ref_h)
+                nx = _norm_to_px(cx_min, ref_w)
+                ny = _norm_to_px(cy_min, ref_h)
+                nw = _norm_to_px(cx_max - cx_min, ref_w)
+                nh = _norm_to_px(cy_max - cy_min, ref_h)
                 
                 # Validate new crop
                 if nw > 10 and nh > 10:
                     print(f"   ✨ Cleaning up image (removing UI/text)...")
-                    final_img = refined[ny:ny+nh, nx:nx+nw]
-                    _, final_buffer = cv2.imencode(".png", final_img)
-                    return final_buffer.tobytes()
+                    return refined.crop((nx, ny, nx+nw, ny+nh))
                 else:
                     print("   ⚠️ Cleanup crop too small, keeping original.")
-                    return refined_bytes
+                    return refined
             else:
-                return refined_bytes
+                return refined
                 
         except Exception as e:
             print(f"   ⚠️ Double-check failed: {e}, using refined crop.")
-            return refined_bytes
+            return refined
 
     except Exception as e:
         print(f"      ⚠️ Refinement error: {e}")
@@ -567,8 +869,8 @@ async def capture_reference_image(supermarket: str, query: str) -> str:
     """
     print(f"\n📸 Capturing reference image for: {query} at {supermarket}")
     
-    # Try exact name first
-    result = await vision_fetch_product(supermarket, query)
+    # Try exact name first (keeping the search-results screenshot)
+    result = await _vision_fetch(supermarket, query)
     
     # Check if we got any results (exact or similar)
     has_results = (result.get("results") and len(result["results"]) > 0) or \
@@ -579,7 +881,7 @@ async def capture_reference_image(supermarket: str, query: str) -> str:
         simplified = simplify_product_name(query)
         if simplified != query:
             print(f"   Trying simplified name: '{simplified}'...")
-            result = await vision_fetch_product(supermarket, simplified)
+            result = await _vision_fetch(supermarket, simplified)
             has_results = (result.get("results") and len(result["results"]) > 0) or \
                          (result.get("similar_products") and len(result["similar_products"]) > 0)
     
@@ -588,18 +890,13 @@ async def capture_reference_image(supermarket: str, query: str) -> str:
         return ""
     
     # We found SOMETHING! Let's save it
-    # The screenshot exists at this point
-    supermarket_key = supermarket.lower().strip()
-    debug_screenshot = str(BASE_DIR / "debug" / f"debug_vision_{supermarket_key}.png")
+    # The screenshot of these results comes back with them
+    full_screenshot = result.pop("screenshot", None)
     
-    if not Path(debug_screenshot).exists():
-        print(f"⚠️  Screenshot file not found, cannot save reference image")
+    if not full_screenshot:
+        print(f"⚠️  No screenshot available, cannot save reference image")
         return ""
     
-    # Read the full screenshot
-    with open(debug_screenshot, 'rb') as f:
-        full_screenshot = f.read()
-    
     # Crop to just the product package image
     print(f"   🔍 Extracting product package from screenshot...")
     try:
@@ -611,7 +908,7 @@ async def capture_reference_image(supermarket: str, query: str) -> str:
     
     # Save the product image as reference, only if cropping was successful
     if product_image:
-        ref_path = save_product_image(query, supermarket, product_image)
+        ref_path = await save_product_image_async(query, supermarket, product_image)
         print(f"✅ Reference image saved: {ref_path}")
         
         # Show what we captured
@@ -629,6 +926,341 @@ async def capture_reference_image(supermarket: str, query: str) -> str:
 
 
 
+# One Chromium per process, reused by every fetch (launching costs seconds and
+# hundreds of MB per call). Playwright objects belong to the event loop that
+# started them, so a new loop gets a new browser.
+_playwright = None
+_browser = None
+_browser_lock: Optional[asyncio.Lock] = None
+_browser_loop = None
+
+
+async def _get_browser():
+    """Return the shared browser, launching it on first use (or after a crash)."""
+    global _playwright, _browser, _browser_lock, _browser_loop
+    loop = asyncio.get_running_loop()
+    if _browser_loop is not loop:
+        _playwright, _browser, _browser_lock, _browser_loop = None, None, asyncio.Lock(), loop
+    
+    async with _browser_lock:
+        if _browser is None or not _browser.is_connected():
+            if _playwright is None:
+                # Imported on first launch so crop/compare-only callers never load Playwright
+                from playwright.async_api import async_playwright
+                _playwright = await async_playwright().start()
+            # Launch with stealth mode to bypass bot detection
+            _browser = await _playwright.chromium.launch(
+                headless=VISION_HEADLESS,
+                args=[
+                    '--disable-blink-features=AutomationControlled',  # Hide automation
+                    '--disable-dev-shm-usage',
+                    '--no-sandbox',
+                ]
+            )
+    return _browser
+
+
+async def close_browser():
+    """Close the shared browser and stop Playwright (call once at shutdown)."""
+    global _playwright, _browser, _browser_loop
+    if _browser is not None:
+        await _browser.close()
+    if _playwright is not None:
+        await _playwright.stop()
+    _playwright, _browser, _browser_loop = None, None, None
+
+
+# Supermarket URL mappings
+_SUPERMARKET_URLS = {
+    "tesco": "https://www.tesco.com/groceries/en-GB/",
+    "sainsburys": "https://www.sainsburys.co.uk/shop/gb/groceries",
+    "sainsbury's": "https://www.sainsburys.co.uk/shop/gb/groceries",
+    "waitrose": "https://www.waitrose.com/ecom/shop/browse/groceries",
+    "aldi": "https://groceries.aldi.co.uk/",
+    "lidl": "https://www.lidl.co.uk/",
+    "morrisons": "https://groceries.morrisons.com/",
+    "m&s": "https://www.marksandspencer.com/c/food-to-order",
+    "marks and spencer": "https://www.marksandspencer.com/c/food-to-order",
+    "cooperative": "https://www.coop.co.uk/",
+    "co-op": "https://www.coop.co.uk/",
+}
+_SUPPORTED_SUPERMARKETS = ", ".join(sorted(set(_SUPERMARKET_URLS)))
+
+# Cookie consent buttons, tried in order (first visible one is clicked)
+_COOKIE_SELECTORS = (
+    'button:has-text("Reject all")',
+    'button:has-text("Accept all")',
+    'button:has-text("Continue and accept")',
+    'button:has-text("Required only")',
+    'button:has-text("Reject")',
+    'button:has-text("Accept")',
+    '#onetrust-reject-all-handler',
+    '#onetrust-accept-btn-handler',
+)
+
+# Close buttons for promotional / newsletter banners and popups
+_BANNER_CLOSE_SELECTORS = (
+    'button[aria-label*="close" i]',
+    'button[aria-label*="dismiss" i]',
+    '[class*="close"][role="button"]',
+    '[class*="dismiss"][role="button"]',
+    'button.close',
+    'button[title*="close" i]',
+    '[data-testid*="close"]',
+    '[data-testid*="dismiss"]',
+    # Common X button patterns
+    'button:has-text("×")',
+    'button:has-text("✕")',
+    'svg[class*="close"]',
+)
+
+# Search input fields - expanded list for different supermarkets
+_SEARCH_INPUT_SELECTORS = (
+    'input[data-auto*="search"]',
+    'input[placeholder*="search" i]',
+    'input[placeholder*="product" i]',
+    'input[placeholder*="find" i]',
+    'input[type="text"][name*="search" i]',
+    'input[type="search"]',
+    'input.search',
+    'input[id*="search" i]',
+    '#search-input',
+    '[role="searchbox"]',
+    'input[aria-label*="search" i]',
+    'input[name="q"]',  # Common search param
+    'input[name="query"]',
+)
+# Same selectors as one CSS selector list, parsed once by the browser per probe
+_SEARCH_INPUT_SELECTOR_LIST = ", ".join(_SEARCH_INPUT_SELECTORS)
+
+# Persistent cookie banners / overlays hidden right before the results screenshot
+_OVERLAY_CLEANUP_SELECTORS = (
+    # Cookie banners
+    '[id*="cookie" i]',
+    '[class*="cookie" i]',
+    '[data-testid*="cookie" i]',
+    # Consent banners
+    '[id*="consent" i]',
+    '[class*="consent" i]',
+    # Overlays
+    '[class*="overlay" i]',
+    '[class*="modal" i]',
+    # Specific Sainsbury's patterns
+    '[class*="CookieBanner" i]',
+    '[data-testid*="banner" i]',
+)
+
+# Image requests blocked while the landing page loads and the search box is found;
+# only the results page needs images (for the screenshot). Matching by URL keeps
+# every other request on Playwright's fast path (no per-request Python handler)
+_IMAGE_URL_RE = re.compile(r"\.(?:png|jpe?g|gif|webp|avif|svg|ico)(?:[?#]|$)", re.IGNORECASE)
+
+
+async def _abort_route(route):
+    await route.abort()
+
+
+# Context init script: once the search has been submitted (flag set in sessionStorage),
+# every new document gets a stylesheet hiding the overlay selectors at document start,
+# so the results page never lays out its banners. The landing page is left alone so
+# the cookie consent can still be clicked.
+_OVERLAY_HIDE_FLAG = "grocefyHideOverlays"
+_EARLY_OVERLAY_HIDE_JS = """
+(() => {
+    try {
+        if (sessionStorage.getItem(%s) !== '1') return;
+    } catch (e) {
+        return;
+    }
+    const style = document.createElement('style');
+    style.textContent = %s;
+    (document.head || document.documentElement).appendChild(style);
+})();
+""" % (
+    json.dumps(_OVERLAY_HIDE_FLAG),
+    json.dumps(", ".join(_OVERLAY_CLEANUP_SELECTORS) + " { display: none !important; }"),
+)
+
+# Remaining "Accept" / "Continue" buttons clicked before the results screenshot
+_FINAL_COOKIE_BUTTONS = (
+    'button:has-text("Continue and accept")',
+    'button:has-text("Accept all")',
+    'button:has-text("Required only")',
+)
+
+
+# Top token-overlap candidates verified while the LLM is still choosing the best match
+SPECULATIVE_VERIFY_CANDIDATES = 3
+
+# Token-set similarity (shared / all distinct tokens of query and name) at or above
+# which the best match is accepted without the LLM verification call, and at or
+# below which it is rejected without one. The accept bar is high on purpose: a
+# one-word variant such as "Mini" must still go through verification
+VERIFY_SKIP_ACCEPT_OVERLAP = 0.9
+VERIFY_SKIP_REJECT_OVERLAP = 0.1
+
+
+# Text-only answers (best-match selection, match verification), keyed by prompt hash.
+# The prompts are fully determined by the query and the candidates, so repeated
+# queries reuse the answer instead of another LLM round-trip
+_text_response_cache = TTLCache(maxsize=4096, ttl=3600)
+
+
+async def _generate_text(prompt: str) -> str:
+    """Text-only Gemini call on the Gemini thread pool (keeps the event loop free); returns the response text."""
+    key = hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+    if key in _text_response_cache:
+        return _text_response_cache[key]
+    loop = asyncio.get_running_loop()
+    response = await loop.run_in_executor(_GEMINI_EXECUTOR, vision_model.generate_content, [prompt])
+    text = response.text
+    if text:
+        _text_response_cache[key] = text
+    return text
+
+
+# How long to wait for any search input to become visible
+SEARCH_INPUT_TIMEOUT_MS = 3000
+
+# Polls every 50ms for a visible match of the combined selector list (one
+# querySelectorAll per tick) and resolves to that element, or to null after the
+# timeout. When several inputs are visible, the earliest selector in the priority
+# list wins
+_FIRST_VISIBLE_JS = """
+([combined, selectors, timeoutMs]) => new Promise(resolve => {
+    const isVisible = (el) => {
+        const r = el.getBoundingClientRect();
+        if (r.width <= 0 || r.height <= 0) return false;
+        const style = getComputedStyle(el);
+        return style.visibility !== 'hidden' && style.display !== 'none';
+    };
+    const probe = () => {
+        const visible = Array.from(document.querySelectorAll(combined)).filter(isVisible);
+        if (visible.length <= 1) return visible[0] || null;
+        for (const selector of selectors) {
+            const el = visible.find(candidate => candidate.matches(selector));
+            if (el) return el;
+        }
+        return visible[0];
+    };
+    const deadline = Date.now() + timeoutMs;
+    const tick = () => {
+        const el = probe();
+        if (el || Date.now() >= deadline) return resolve(el);
+        setTimeout(tick, 50);
+    };
+    tick();
+})
+"""
+
+# Scrolls 3 x 800px (waiting a frame after each step so lazy images start loading),
+# then returns to the top
+_LAZY_LOAD_SCROLL_JS = """
+async () => {
+    const nextFrame = () => new Promise(resolve => requestAnimationFrame(() => resolve()));
+    for (let i = 0; i < 3; i++) {
+        window.scrollBy(0, 800);
+        await nextFrame();
+    }
+    window.scrollTo(0, 0);
+    await nextFrame();
+}
+"""
+
+# True once every image intersecting the viewport has finished loading
+_VIEWPORT_IMAGES_LOADED_JS = """
+() => Array.from(document.images).every(img => {
+    const r = img.getBoundingClientRect();
+    const inView = r.bottom > 0 && r.top < window.innerHeight && r.width > 0 && r.height > 0;
+    return !inView || img.complete;
+})
+"""
+
+# Sets display:none on every visible element matching any of the selectors
+_HIDE_VISIBLE_JS = """
+(selectors) => {
+    for (const selector of selectors) {
+        let elements;
+        try {
+            elements = document.querySelectorAll(selector);
+        } catch (e) {
+            continue;
+        }
+        for (const el of elements) {
+            const r = el.getBoundingClientRect();
+            if (r.width > 0 && r.height > 0 && getComputedStyle(el).visibility !== 'hidden') {
+                el.style.display = 'none';
+            }
+        }
+    }
+}
+"""
+
+# Clicks visible matches for a list of selectors inside the page, in one round-trip.
+# Each spec is {css, text, label}; ``text`` mimics Playwright's :has-text() (case-insensitive substring).
+_CLICK_VISIBLE_JS = """
+([specs, firstOnly]) => {
+    const clicked = [];
+    const isVisible = (el) => {
+        const r = el.getBoundingClientRect();
+        if (r.width <= 0 || r.height <= 0) return false;
+        const style = getComputedStyle(el);
+        return style.visibility !== 'hidden' && style.display !== 'none';
+    };
+    for (const spec of specs) {
+        let elements;
+        try {
+            elements = document.querySelectorAll(spec.css);
+        } catch (e) {
+            continue;
+        }
+        for (const el of elements) {
+            if (spec.text && !(el.textContent || '').toLowerCase().includes(spec.text)) continue;
+            if (!isVisible(el)) continue;
+            if (typeof el.click === 'function') {
+                el.click();
+            } else {
+                el.dispatchEvent(new MouseEvent('click', {bubbles: true}));  // e.g. <svg>
+            }
+            clicked.push(spec.label);
+            if (firstOnly) return clicked;
+        }
+    }
+    return clicked;
+}
+"""
+
+# Pre-screenshot cleanup in one round-trip: hide the overlays, then click the first
+# visible remaining "Accept" / "Continue" button; returns the selectors clicked
+_FINAL_CLEANUP_JS = """
+([hideSelectors, clickSpecs]) => {
+    (%s)(hideSelectors);
+    return (%s)([clickSpecs, true]);
+}
+""" % (_HIDE_VISIBLE_JS.strip(), _CLICK_VISIBLE_JS.strip())
+
+_HAS_TEXT_RE = re.compile(r'^(.*):has-text\("(.*)"\)$')
+
+
+def _selector_spec(selector: str) -> dict:
+    """Translate a Playwright selector into a plain CSS selector plus optional text filter."""
+    has_text = _HAS_TEXT_RE.match(selector)
+    if has_text:
+        return {"css": has_text.group(1) or "*", "text": has_text.group(2).lower(), "label": selector}
+    return {"css": selector, "text": None, "label": selector}
+
+
+@lru_cache(maxsize=None)
+def _selector_specs(selectors: tuple[str, ...]) -> list[dict]:
+    """Specs for a selector tuple (built once per module-level selector constant)."""
+    return [_selector_spec(selector) for selector in selectors]
+
+
+async def click_visible(page, selectors: tuple[str, ...], first_only: bool = False) -> list[str]:
+    """Click visible elements matching ``selectors`` in one page.evaluate; returns the selectors clicked."""
+    return await page.evaluate(_CLICK_VISIBLE_JS, [_selector_specs(tuple(selectors)), first_only])
+
+
 async def vision_fetch_product(supermarket: str, query: str) -> dict:
     """
     Fetch prices from a supermarket using vision-based navigation
@@ -637,152 +1269,137 @@ async def vision_fetch_product(supermarket: str, query: str) -> dict:
         supermarket: Name of the supermarket (e.g., "Tesco", "Sainsbury's", "Aldi")
         query: Product to search for
     """
+    result = await _vision_fetch(supermarket, query)
+    result.pop("screenshot", None)  # raw bytes are for internal callers, not the agent
+    return result
+
+
+# Default number of (supermarket, query) fetches in flight at once in a batch.
+# Each fetch gets its own browser context; Gemini calls are still throttled by the rate limiter
+VISION_FETCH_BATCH_CONCURRENCY = 8
+
+
+async def vision_fetch_products_batch(pairs: list[tuple[str, str]],
+                                      concurrency: int = VISION_FETCH_BATCH_CONCURRENCY) -> list[dict]:
+    """
+    Run vision_fetch_product for many (supermarket, query) pairs concurrently,
+    at most ``concurrency`` at a time. Results come back in the order of ``pairs``;
+    a fetch that raises is reported as an error dict instead of failing the batch.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _one(supermarket: str, query: str) -> dict:
+        async with semaphore:
+            return await vision_fetch_product(supermarket, query)
+
+    results = await asyncio.gather(*(_one(sm, q) for sm, q in pairs), return_exceptions=True)
+    return [
+        {"error": str(r), "results": []} if isinstance(r, Exception) else r
+        for r in results
+    ]
+
+
+async def _vision_fetch(supermarket: str, query: str) -> dict:
+    """
+    Implementation of vision_fetch_product. When products were found (exact or
+    similar), the result also carries the search-results screenshot bytes under
+    ``"screenshot"`` so callers can crop it without going through the disk.
+    """
     print(f"\n🔍 Vision-based search for: {query} at {supermarket}")
     
-    # Supermarket URL mappings
-    SUPERMARKET_URLS = {
-        "tesco": "https://www.tesco.com/groceries/en-GB/",
-        "sainsburys": "https://www.sainsburys.co.uk/shop/gb/groceries",
-        "sainsbury's": "https://www.sainsburys.co.uk/shop/gb/groceries",
-        "waitrose": "https://www.waitrose.com/ecom/shop/browse/groceries",
-        "aldi": "https://groceries.aldi.co.uk/",
-        "lidl": "https://www.lidl.co.uk/",
-        "morrisons": "https://groceries.morrisons.com/",
-        "m&s": "https://www.marksandspencer.com/c/food-to-order",
-        "marks and spencer": "https://www.marksandspencer.com/c/food-to-order",
-        "cooperative": "https://www.coop.co.uk/",
-        "co-op": "https://www.coop.co.uk/",
-    }
-    
     supermarket_key = supermarket.lower().strip()
-    if supermarket_key not in SUPERMARKET_URLS:
-        supported = ", ".join(sorted(set(SUPERMARKET_URLS.keys())))
+    if supermarket_key not in _SUPERMARKET_URLS:
         return {
-            "error": f"Supermarket '{supermarket}' not supported. Supported supermarkets: {supported}",
+            "error": f"Supermarket '{supermarket}' not supported. Supported supermarkets: {_SUPPORTED_SUPERMARKETS}",
             "results": []
         }
     
-    base_url = SUPERMARKET_URLS[supermarket_key]
+    base_url = _SUPERMARKET_URLS[supermarket_key]
     
-    async with async_playwright() as p:
-        # Launch with stealth mode to bypass bot detection
-        browser = await p.chromium.launch(
-            headless=False,
-            args=[
-                '--disable-blink-features=AutomationControlled',  # Hide automation
-                '--disable-dev-shm-usage',
-                '--no-sandbox',
-            ]
-        )
+    # Shared browser (launched once); each fetch gets its own fresh context
+    browser = await _get_browser()
+    
+    # Create context with realistic settings
+    context = await browser.new_context(
+        viewport=SCREENSHOT_VIEWPORT,
+        user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        locale='en-GB',
+        timezone_id='Europe/London',
+    )
+    
+    # Apply stealth techniques
+    await context.add_init_script("""
+        // Remove webdriver property
+        Object.defineProperty(navigator, 'webdriver', {
+            get: () => undefined
+        });
         
-        # Create context with realistic settings
-        context = await browser.new_context(
-            viewport={'width': 1920, 'height': 1080},
-            user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            locale='en-GB',
-            timezone_id='Europe/London',
-        )
+        // Mock plugins
+        Object.defineProperty(navigator, 'plugins', {
+            get: () => [1, 2, 3, 4, 5]
+        });
         
-        # Apply stealth techniques
-        await context.add_init_script("""
-            // Remove webdriver property
-            Object.defineProperty(navigator, 'webdriver', {
-                get: () => undefined
-            });
-            
-            // Mock plugins
-            Object.defineProperty(navigator, 'plugins', {
-                get: () => [1, 2, 3, 4, 5]
-            });
-            
-            // Mock languages
-            Object.defineProperty(navigator, 'languages', {
-                get: () => ['en-GB', 'en']
-            });
-        """)
+        // Mock languages
+        Object.defineProperty(navigator, 'languages', {
+            get: () => ['en-GB', 'en']
+        });
+    """)
+    # Hide banners before first paint on the pages loaded after the search
+    await context.add_init_script(_EARLY_OVERLAY_HIDE_JS)
+    
+    # Skip image downloads until the search is submitted (or, failing that, until the screenshot)
+    await context.route(_IMAGE_URL_RE, _abort_route)
+    images_blocked = True
+    
+    page = await context.new_page()
+    
+    try:
+        # Step 1: Navigate to supermarket
+        print(f"📍 [{query} @ {supermarket}] Navigating to {supermarket}...")
+        await page.goto(base_url, timeout=120000)
+        # Replace fixed wait with smart wait for DOM ready
+        try:
+            await page.wait_for_load_state("domcontentloaded", timeout=10000)
+        except:
+            pass # Proceed if timeout, page might be usable
+        
+        # Step 2: Handle cookies - try common selectors first
+        print(f"🍪 [{query} @ {supermarket}] Handling cookies...")
+        # One in-page pass over all selectors, clicking the first visible button
+        try:
+            clicked = await click_visible(page, _COOKIE_SELECTORS, first_only=True)
+        except Exception:
+            clicked = []
+        cookie_handled = bool(clicked)
+        if cookie_handled:
+            print(f"✅ [{query} @ {supermarket}] Clicked cookie button: {clicked[0]}")
         
-        page = await context.new_page()
+        if not cookie_handled:
+            print(f"⚠️  [{query} @ {supermarket}] No cookie button found, continuing anyway")
         
+        # Step 2.5: Close any banners/popups (promotional, newsletter, etc.)
+        print(f"🚫 [{query} @ {supermarket}] Closing banners and popups...")
+        # Click every visible close button in one in-page pass
         try:
-            # Step 1: Navigate to supermarket
-            print(f"📍 [{query} @ {supermarket}] Navigating to {supermarket}...")
-            await page.goto(base_url, timeout=120000)
-            # Replace fixed wait with smart wait for DOM ready
-            try:
-                await page.wait_for_load_state("domcontentloaded", timeout=10000)
-            except:
-                pass # Proceed if timeout, page might be usable
-            
-            # Step 2: Handle cookies - try common selectors first
-            print(f"🍪 [{query} @ {supermarket}] Handling cookies...")
-            cookie_selectors = [
-                'button:has-text("Reject all")',
-                'button:has-text("Accept all")',  
-                'button:has-text("Continue and accept")',
-                'button:has-text("Required only")',
-                'button:has-text("Reject")', 
-                'button:has-text("Accept")', 
-                '#onetrust-reject-all-handler',
-                '#onetrust-accept-btn-handler',
-            ]
-            
-            cookie_handled = False
-            for selector in cookie_selectors:
-                try:
-                    # Reduced timeout for checking each cookie button
-                    if await page.is_visible(selector, timeout=500):
-                        await page.click(selector)
-                        print(f"✅ [{query} @ {supermarket}] Clicked cookie button: {selector}")
-                        cookie_handled = True
-                        break
-                except:
-                    continue
-            
-            if not cookie_handled:
-                print(f"⚠️  [{query} @ {supermarket}] No cookie button found, continuing anyway")
-            
-            # Step 2.5: Close any banners/popups (promotional, newsletter, etc.)
-            print(f"🚫 [{query} @ {supermarket}] Closing banners and popups...")
-            banner_close_selectors = [
-                'button[aria-label*="close" i]',
-                'button[aria-label*="dismiss" i]',
-                '[class*="close"][role="button"]',
-                '[class*="dismiss"][role="button"]',
-                'button.close',
-                'button[title*="close" i]',
-                '[data-testid*="close"]',
-                '[data-testid*="dismiss"]',
-                # Common X button patterns
-                'button:has-text("×")',
-                'button:has-text("✕")',
-                'svg[class*="close"]',
-            ]
-            
-            banners_closed = 0
-            for selector in banner_close_selectors:
-                try:
-                    # Quick check for visibility
-                    elements = await page.query_selector_all(selector)
-                    for element in elements:
-                        try:
-                            if await element.is_visible():
-                                await element.click(timeout=500)
-                                banners_closed += 1
-                                print(f"✅ Closed banner/popup: {selector}")
-                        except:
-                            continue
-                except:
-                    continue
-            
-            if banners_closed > 0:
-                print(f"✅ Closed {banners_closed} banner(s)/popup(s)")
-            else:
-                print("⚠️  No banners/popups found to close")
-            
-            # Step 3: Use vision to find the search box
-            print(f"🔎 [{query} @ {supermarket}] Looking for search box...")
-            screenshot_bytes, _ = await take_screenshot(page)
-            
+            closed = await click_visible(page, _BANNER_CLOSE_SELECTORS)
+        except Exception:
+            closed = []
+        for selector in closed:
+            print(f"✅ Closed banner/popup: {selector}")
+        banners_closed = len(closed)
+        
+        if banners_closed > 0:
+            print(f"✅ Closed {banners_closed} banner(s)/popup(s)")
+        else:
+            print("⚠️  No banners/popups found to close")
+        
+        # Step 3: Find the search box
+        print(f"🔎 [{query} @ {supermarket}] Looking for search box...")
+        # Asking the vision model to describe the search box is debug-only: the
+        # description is logged, not used, and costs a screenshot + LLM round-trip
+        if DEBUG_DESCRIBE_SEARCH_BOX:
+            screenshot_bytes = await take_screenshot(page)
+        
             search_locate_prompt = """
             Look at this grocery website screenshot.
             Can you see a search box or search input field?
@@ -790,378 +1407,362 @@ async def vision_fetch_product(supermarket: str, query: str) -> dict:
             If you see a magnifying glass icon or "Search" text, describe where it is.
             Be specific and brief.
             """
-            
+        
             search_description = await ask_vision_model(screenshot_bytes, search_locate_prompt)
             print(f"📦 Vision says: {search_description}")
-            
-            # Try multiple search strategies
-            search_submitted = False
-            
-            # Strategy 1: Try clicking search icon first
+        
+        # Try multiple search strategies
+        search_submitted = False
+        
+        # Strategy 1: Try clicking search icon first
+        try:
+            # Look for search icon/button
+            search_icon = await page.wait_for_selector('[aria-label*="search" i], button[title*="search" i], [data-auto*="search"]', timeout=2000)
+            await search_icon.click()
+            print("✅ Clicked search icon")
+        except:
+            print("⚠️  No search icon found")
+        
+        # Strategy 2: Try to find input field
+        try:
+            # Probe the combined selector list in the page (priority order breaks ties)
+            search_input = None
             try:
-                # Look for search icon/button
-                search_icon = await page.wait_for_selector('[aria-label*="search" i], button[title*="search" i], [data-auto*="search"]', timeout=2000)
-                await search_icon.click()
-                print("✅ Clicked search icon")
+                found = await page.evaluate_handle(
+                    _FIRST_VISIBLE_JS,
+                    [_SEARCH_INPUT_SELECTOR_LIST, list(_SEARCH_INPUT_SELECTORS), SEARCH_INPUT_TIMEOUT_MS]
+                )
+                search_input = found.as_element()
             except:
-                print("⚠️  No search icon found")
+                pass
+            if search_input:
+                print("✅ Found search input")
             
-            # Strategy 2: Try to find input field
-            try:
-                # Try various selectors - expanded list for different supermarkets
-                selectors_to_try = [
-                    'input[data-auto*="search"]',
-                    'input[placeholder*="search" i]',
-                    'input[placeholder*="product" i]',
-                    'input[placeholder*="find" i]',
-                    'input[type="text"][name*="search" i]',
-                    'input[type="search"]',
-                    'input.search',
-                    'input[id*="search" i]',
-                    '#search-input',
-                    '[role="searchbox"]',
-                    'input[aria-label*="search" i]',
-                    'input[name="q"]',  # Common search param
-                    'input[name="query"]',
-                ]
+            if search_input:
+                await search_input.fill(query)
+                # Results documents loaded from here on hide overlays at document start
+                # and load their images again (needed for the screenshot)
+                try:
+                    await page.evaluate(
+                        "flag => sessionStorage.setItem(flag, '1')", _OVERLAY_HIDE_FLAG
+                    )
+                except:
+                    pass
+                await context.unroute(_IMAGE_URL_RE, _abort_route)
+                images_blocked = False
+                await search_input.press("Enter")
+                print(f"✅ [{query} @ {supermarket}] Search submitted")
+                search_submitted = True
                 
-                search_input = None
-                for selector in selectors_to_try:
-                    try:
-                        # Reduced timeout for finding search input
-                        search_input = await page.wait_for_selector(selector, state="visible", timeout=1000)
-                        if search_input:
-                            print(f"✅ Found search input: {selector}")
-                            break
-                    except:
-                        continue
+                # Wait for results - smart wait
+                print(f"⏳ [{query} @ {supermarket}] Waiting for results to load...")
+                try:
+                    # Wait for network to be idle (meaning results likely loaded)
+                    await page.wait_for_load_state("networkidle", timeout=8000)
+                except:
+                    print(f"⚠️  [{query} @ {supermarket}] Network idle timeout, proceeding anyway...")
                 
-                if search_input:
-                    await search_input.fill(query)
-                    await search_input.press("Enter")
-                    print(f"✅ [{query} @ {supermarket}] Search submitted")
-                    search_submitted = True
-                    
-                    # Wait for results - smart wait
-                    print(f"⏳ [{query} @ {supermarket}] Waiting for results to load...")
-                    try:
-                        # Wait for network to be idle (meaning results likely loaded)
-                        await page.wait_for_load_state("networkidle", timeout=8000)
-                    except:
-                        print(f"⚠️  [{query} @ {supermarket}] Network idle timeout, proceeding anyway...")
-                    
-                    # Scroll down gradually to trigger lazy loading of images
-                    print(f"📜 [{query} @ {supermarket}] Scrolling to trigger lazy loading...")
-                    for i in range(3):
-                        await page.evaluate("window.scrollBy(0, 800)")
-                        await page.wait_for_timeout(500)
-                    
-                    # Scroll back up to top to capture the first results
-                    await page.evaluate("window.scrollTo(0, 0)")
-                    await page.wait_for_timeout(1000)
-                    
-                else:
-                    print("❌ Could not find search input field")
-                    
-            except Exception as e:
-                print(f"❌ Search error: {e}")
+                # Scroll down gradually to trigger lazy loading of images, then back up
+                # to the top to capture the first results (one in-page round-trip)
+                print(f"📜 [{query} @ {supermarket}] Scrolling to trigger lazy loading...")
+                await page.evaluate(_LAZY_LOAD_SCROLL_JS)
+                
+            else:
+                print("❌ Could not find search input field")
+                
+        except Exception as e:
+            print(f"❌ Search error: {e}")
+        finally:
+            # The screenshot below needs product images, whatever happened above
+            if images_blocked:
+                await context.unroute(_IMAGE_URL_RE, _abort_route)
+                images_blocked = False
+        
+        # Proceed to screenshot even if search submission had minor issues (might have worked)
+        
+        # Step 5: Take screenshot of results and extract products
+        try:
+            # Wait for the page to settle before taking a screenshot
+            # Wait specifically for images to be present
+            try:
+                await page.wait_for_selector("img", timeout=5000)
+            except:
+                pass
             
-            # Proceed to screenshot even if search submission had minor issues (might have worked)
+            # ...and for the images in view to finish loading (returns at once when they have)
+            try:
+                await page.wait_for_function(_VIEWPORT_IMAGES_LOADED_JS, timeout=5000)
+            except:
+                pass
             
-            # Step 5: Take screenshot of results and extract products
+            # CRITICAL: Remove any persistent cookie banners/overlays BEFORE screenshot
+            print(f"🧹 [{query} @ {supermarket}] Final cleanup of cookie banners...")
+            # Usually already hidden by the init stylesheet; this pass covers
+            # in-place (no navigation) results and late-inserted overlays.
+            # The same evaluate also clicks any remaining "Accept" or "Continue" button
             try:
-                # Wait for the page to settle before taking a screenshot
-                # Wait specifically for images to be present
+                clicked = await page.evaluate(
+                    _FINAL_CLEANUP_JS,
+                    [list(_OVERLAY_CLEANUP_SELECTORS), _selector_specs(_FINAL_COOKIE_BUTTONS)]
+                )
+            except:
+                clicked = []
+            if clicked:
+                btn_selector = clicked[0]
                 try:
-                    await page.wait_for_selector("img", timeout=5000)
+                    await page.wait_for_selector(btn_selector, state="hidden", timeout=2000)
                 except:
                     pass
-                    
-                await page.wait_for_timeout(2000)
+                print(f"✅ Clicked final cookie button: {btn_selector}")
+            
+            screenshot_bytes = await take_screenshot(page)
+            
+            # Save screenshot for debugging
+            if DEBUG_DUMP_SCREENSHOTS:
+                screenshot_filename = str(BASE_DIR / "debug" / f"debug_vision_{supermarket_key}.jpg")
+                await asyncio.to_thread(Path(screenshot_filename).write_bytes, screenshot_bytes)
+                print(f"💾 [{query} @ {supermarket}] Saved screenshot to {screenshot_filename}")
+        except Exception as e:
+            print(f"⚠️ Failed to take screenshot: {e}")
+            return {"error": f"Browser error during screenshot: {e}", "results": []}
+        
+        extraction_prompt = f"""
+        You are looking at search results for "{query}" on the {supermarket} website.
+        
+        IMPORTANT INSTRUCTIONS FOR FINDING PRICES:
+        - Look for £ or € symbols - these indicate prices
+        - Each product is in its own box/card on the page
+        - Prices are ALWAYS shown with the currency symbol (£ or €)
+        - Supermarkets often show TWO prices:
+          * "Membership price" (discounted price for members, e.g., Clubcard, Nectar)
+          * "Regular price" (standard price for non-members)
+        - If you see both prices, include BOTH in your response
+        
+        Please extract ALL visible products from this screenshot.
+        For each product, provide:
+        1. Product name (full name as shown)
+        2. Regular price (the standard TOTAL price with £ symbol, e.g., "£2.50")
+        3. Membership price (if shown - the discounted TOTAL price for members, e.g., "£2.00")
+        4. Unit price if visible (e.g., "£1.50/kg" or "£2.75/litre")
+        
+        CRITICAL DISTINCTION:
+        - "membership_price" is the TOTAL price for the product (e.g., "£2.00")
+        - "unit_price" is the price PER UNIT with a slash (e.g., "£32.61/kg", "£1.50/litre")
+        - DO NOT confuse unit prices (with /kg, /litre, etc.) with membership prices
+        - Membership prices NEVER have a slash or unit suffix
+        
+        Format your response as a JSON array like this:
+        [
+          {{
+            "name": "Product Name Here",
+            "regular_price": "£2.50",
+            "membership_price": "£2.00",
+            "unit_price": "£1.25/kg"
+          }},
+          {{
+            "name": "Another Product",
+            "regular_price": "£3.00",
+            "membership_price": null,
+            "unit_price": "£1.50/litre"
+          }}
+        ]
+        
+        CRITICAL: Look carefully at each product box for the £ symbol. Don't miss prices!
+        Only include products you can clearly see. If you can't see any products, return an empty array [].
+        IMPORTANT: Return ONLY the JSON array, no other text or markdown formatting.
+        """
+        
+        products_json = await ask_vision_model(screenshot_bytes, extraction_prompt)
+        print(f"\n📊 Gemini's response:\n{products_json}")
+        
+        # Parse JSON response
+        try:
+            # Clean up the response (remove markdown code blocks if present)
+            cleaned = _extract_json(products_json)
+            
+            products = _json.loads(cleaned)
+            print(f"\n✅ Found {len(products)} products")
+            
+            # ---- Verification function to ensure exact match ----
+            async def verify_product_match(query: str, candidate: dict) -> tuple[bool, str]:
+                """Use Gemini to strictly verify if the candidate product matches the query.
                 
-                # CRITICAL: Remove any persistent cookie banners/overlays BEFORE screenshot
-                print(f"🧹 [{query} @ {supermarket}] Final cleanup of cookie banners...")
-                cleanup_selectors = [
-                    # Cookie banners
-                    '[id*="cookie" i]',
-                    '[class*="cookie" i]',
-                    '[data-testid*="cookie" i]',
-                    # Consent banners
-                    '[id*="consent" i]',
-                    '[class*="consent" i]',
-                    # Overlays
-                    '[class*="overlay" i]',
-                    '[class*="modal" i]',
-                    # Specific Sainsbury's patterns
-                    '[class*="CookieBanner" i]',
-                    '[data-testid*="banner" i]',
-                ]
+                Args:
+                    query: The original search query
+                    candidate: The candidate product dict with name, prices, etc.
                 
-                for selector in cleanup_selectors:
-                    try:
-                        elements = await page.query_selector_all(selector)
-                        for element in elements:
-                            try:
-                                if await element.is_visible():
-                                    # Try to hide it with JavaScript
-                                    await page.evaluate('(el) => el.style.display = "none"', element)
-                            except:
-                                continue
-                    except:
-                        continue
+                Returns:
+                    (is_match, reason): Boolean indicating if it's a match and explanation
+                """
+                verify_prompt = f"""
+                You are a strict product matching verifier.
                 
-                # Also try clicking any remaining "Accept" or "Continue" buttons
-                final_cookie_buttons = [
-                    'button:has-text("Continue and accept")',
-                    'button:has-text("Accept all")',
-                    'button:has-text("Required only")',
-                ]
-                for btn_selector in final_cookie_buttons:
-                    try:
-                        if await page.is_visible(btn_selector, timeout=500):
-                            await page.click(btn_selector)
-                            await page.wait_for_timeout(500)
-                            print(f"✅ Clicked final cookie button: {btn_selector}")
-                            break
-                    except:
-                        continue
+                User searched for: "{query}"
+                Product found: "{candidate.get('name', '')}"
                 
-                screenshot_bytes, _ = await take_screenshot(page)
+                Your task is to determine if these represent THE SAME PRODUCT.
                 
-                # Save screenshot for debugging
-                screenshot_filename = str(BASE_DIR / "debug" / f"debug_vision_{supermarket_key}.png")
-                Path(screenshot_filename).write_bytes(screenshot_bytes)
-                print(f"💾 [{query} @ {supermarket}] Saved screenshot to {screenshot_filename}")
-            except Exception as e:
-                print(f"⚠️ Failed to take screenshot: {e}")
-                return {"error": f"Browser error during screenshot: {e}", "results": []}
-            
-            extraction_prompt = f"""
-            You are looking at search results for "{query}" on the {supermarket} website.
-            
-            IMPORTANT INSTRUCTIONS FOR FINDING PRICES:
-            - Look for £ or € symbols - these indicate prices
-            - Each product is in its own box/card on the page
-            - Prices are ALWAYS shown with the currency symbol (£ or €)
-            - Supermarkets often show TWO prices:
-              * "Membership price" (discounted price for members, e.g., Clubcard, Nectar)
-              * "Regular price" (standard price for non-members)
-            - If you see both prices, include BOTH in your response
+                STRICT MATCHING RULES:
+                1. Brand name must match (e.g., "Tunnock's" vs "Tunnocks" is OK, but "Cadbury" vs "Nestle" is NOT)
+                2. Product type must match exactly (e.g., "Mini" vs regular size is DIFFERENT)
+                3. Flavor/variant must match (e.g., "Milk Chocolate" vs "Dark Chocolate" is DIFFERENT)
+                4. Size/quantity differences:
+                   - "Multipack" or specific weights (e.g. "240g") ARE ACCEPTABLE if the core product is the same.
+                   - "Mini" versions are DIFFERENT.
+                   - "Large" vs "Regular" is ACCEPTABLE if not specified in query.
+                5. Minor wording differences are OK (e.g., "Caramel Wafer" vs "Caramel Wafers" is SAME)
+                
+                IMPORTANT: Be strict on BRAND and TYPE, but allow standard packaging variations (multipacks, weights) unless the query specifically excludes them.
+                
+                Respond with a JSON object:
+                {{
+                    "is_match": true or false,
+                    "reason": "Brief explanation of why it matches or doesn't match"
+                }}
+                
+                Example responses:
+                {{"is_match": false, "reason": "Query asks for regular size but product is Mini version"}}
+                {{"is_match": true, "reason": "Same brand, product type, and variant - minor wording differences only"}}
+                """
+                
+                try:
+                    txt = (await _generate_text(verify_prompt)).strip()
+                    print(f"🔍 Verification response: {txt[:200]}...")
+                    
+                    result = _json.loads(_extract_json(txt))
+                    is_match = result.get("is_match", False)
+                    reason = result.get("reason", "No reason provided")
+                    return is_match, reason
+                except Exception as e:
+                    print(f"⚠️ Verification error: {e}")
+                    # On error, be conservative and reject the match
+                    return False, f"Verification failed: {str(e)}"
             
-            Please extract ALL visible products from this screenshot.
-            For each product, provide:
-            1. Product name (full name as shown)
-            2. Regular price (the standard TOTAL price with £ symbol, e.g., "£2.50")
-            3. Membership price (if shown - the discounted TOTAL price for members, e.g., "£2.00")
-            4. Unit price if visible (e.g., "£1.50/kg" or "£2.75/litre")
+            # ---- Select best match using LLM reasoning ----
+            async def select_best_match(products, query):
+                """Use Gemini to reason which product best matches the query.
+                Returns the product dict or None if no suitable match.
+                """
+                match_prompt = f"""
+                You are given a search query and a list of product candidates.
+                Query: \"{query}\"
+                Products (each with name, regular_price, membership_price, unit_price):
+                {_dumps_indented(products)}
+                
+                Your task is to pick the product that most closely matches the query.
+                Consider brand, size (ml, l, g, kg), packaging (e.g., 4x250ml), and type.
+                If none of the products seem to match the query, respond with the word NONE.
+                
+                Respond with a JSON object containing the chosen product (exactly as in the list) or the string "NONE".
+                Example response:
+                {{"name": "Arla Big Milk Fresh Whole Milk Vitamin Enriched for kids 4 X250ml", "regular_price": "£3.75", "membership_price": "£2.75", "unit_price": "£2.75/litre"}}
+                or
+                "NONE"
+                """
+                txt = (await _generate_text(match_prompt)).strip()
+                print(f"🔍 LLM raw response: {txt[:200]}...")  # Debug print
+                # Remove markdown fences properly
+                txt = _extract_json(txt)
+                if txt.upper() == "NONE":
+                    return None
+                try:
+                    parsed = _json.loads(txt)
+                    if isinstance(parsed, dict):
+                        return parsed
+                    else:
+                        return None
+                except Exception as e:
+                    print(f"⚠️ Failed to parse LLM response: {e}")
+                    return None
             
-            CRITICAL DISTINCTION:
-            - "membership_price" is the TOTAL price for the product (e.g., "£2.00")
-            - "unit_price" is the price PER UNIT with a slash (e.g., "£32.61/kg", "£1.50/litre")
-            - DO NOT confuse unit prices (with /kg, /litre, etc.) with membership prices
-            - Membership prices NEVER have a slash or unit suffix
+            def token_overlap(a: str, b: str) -> int:
+                # Handle None values
+                if a is None:
+                    a = ""
+                if b is None:
+                    b = ""
+                a_tokens = set(a.lower().split())
+                b_tokens = set(b.lower().split())
+                return len(a_tokens & b_tokens)
             
-            Format your response as a JSON array like this:
-            [
-              {{
-                "name": "Product Name Here",
-                "regular_price": "£2.50",
-                "membership_price": "£2.00",
-                "unit_price": "£1.25/kg"
-              }},
-              {{
-                "name": "Another Product",
-                "regular_price": "£3.00",
-                "membership_price": null,
-                "unit_price": "£1.50/litre"
-              }}
-            ]
+            def overlap_ratio(a: str, b: str) -> float:
+                a_tokens = set((a or "").lower().split())
+                b_tokens = set((b or "").lower().split())
+                return len(a_tokens & b_tokens) / max(1, len(a_tokens | b_tokens))
             
-            CRITICAL: Look carefully at each product box for the £ symbol. Don't miss prices!
-            Only include products you can clearly see. If you can't see any products, return an empty array [].
-            IMPORTANT: Return ONLY the JSON array, no other text or markdown formatting.
-            """
+            def needs_llm_verification(candidate: dict) -> bool:
+                ratio = overlap_ratio(candidate.get("name", ""), query)
+                return VERIFY_SKIP_REJECT_OVERLAP < ratio < VERIFY_SKIP_ACCEPT_OVERLAP
             
-            products_json = await ask_vision_model(screenshot_bytes, extraction_prompt)
-            print(f"\n📊 Gemini's response:\n{products_json}")
+            # Likely winners by token overlap (stable sort keeps list order on ties)
+            overlap_ranked = sorted(
+                (p for p in products if token_overlap(p.get("name", ""), query) > 0),
+                key=lambda p: token_overlap(p.get("name", ""), query),
+                reverse=True
+            )[:SPECULATIVE_VERIFY_CANDIDATES]
             
-            # Parse JSON response
-            import json
+            # Step 1: Find the best candidate, verifying the likely winners concurrently
+            # so the verification round-trip overlaps the selection round-trip
+            best_task = asyncio.create_task(select_best_match(products, query))
+            verify_tasks = {
+                p.get("name"): asyncio.create_task(verify_product_match(query, p))
+                for p in overlap_ranked
+                if needs_llm_verification(p)
+            }
             try:
-                # Clean up the response (remove markdown code blocks if present)
-                cleaned = products_json.strip()
-                if cleaned.startswith("```"):
-                    cleaned = cleaned.split("```")[1]
-                    if cleaned.startswith("json"):
-                        cleaned = cleaned[4:]
-                cleaned = cleaned.strip()
-                
-                products = json.loads(cleaned)
-                print(f"\n✅ Found {len(products)} products")
-                
-                # ---- Verification function to ensure exact match ----
-                def verify_product_match(query: str, candidate: dict) -> tuple[bool, str]:
-                    """Use Gemini to strictly verify if the candidate product matches the query.
-                    
-                    Args:
-                        query: The original search query
-                        candidate: The candidate product dict with name, prices, etc.
-                    
-                    Returns:
-                        (is_match, reason): Boolean indicating if it's a match and explanation
-                    """
-                    verify_prompt = f"""
-                    You are a strict product matching verifier.
-                    
-                    User searched for: "{query}"
-                    Product found: "{candidate.get('name', '')}"
-                    
-                    Your task is to determine if these represent THE SAME PRODUCT.
-                    
-                    STRICT MATCHING RULES:
-                    1. Brand name must match (e.g., "Tunnock's" vs "Tunnocks" is OK, but "Cadbury" vs "Nestle" is NOT)
-                    2. Product type must match exactly (e.g., "Mini" vs regular size is DIFFERENT)
-                    3. Flavor/variant must match (e.g., "Milk Chocolate" vs "Dark Chocolate" is DIFFERENT)
-                    4. Size/quantity differences:
-                       - "Multipack" or specific weights (e.g. "240g") ARE ACCEPTABLE if the core product is the same.
-                       - "Mini" versions are DIFFERENT.
-                       - "Large" vs "Regular" is ACCEPTABLE if not specified in query.
-                    5. Minor wording differences are OK (e.g., "Caramel Wafer" vs "Caramel Wafers" is SAME)
-                    
-                    IMPORTANT: Be strict on BRAND and TYPE, but allow standard packaging variations (multipacks, weights) unless the query specifically excludes them.
-                    
-                    Respond with a JSON object:
-                    {{
-                        "is_match": true or false,
-                        "reason": "Brief explanation of why it matches or doesn't match"
-                    }}
-                    
-                    Example responses:
-                    {{"is_match": false, "reason": "Query asks for regular size but product is Mini version"}}
-                    {{"is_match": true, "reason": "Same brand, product type, and variant - minor wording differences only"}}
-                    """
-                    
-                    try:
-                        response = vision_model.generate_content([verify_prompt])
-                        txt = response.text.strip()
-                        print(f"🔍 Verification response: {txt[:200]}...")
-                        
-                        # Clean markdown fences
-                        if txt.startswith("```"):
-                            lines = txt.split("\n")
-                            lines = lines[1:]  # Remove first line
-                            if lines and lines[-1].strip() == "```":
-                                lines = lines[:-1]  # Remove last line
-                            txt = "\n".join(lines).strip()
-                        
-                        result = json.loads(txt)
-                        is_match = result.get("is_match", False)
-                        reason = result.get("reason", "No reason provided")
-                        return is_match, reason
-                    except Exception as e:
-                        print(f"⚠️ Verification error: {e}")
-                        # On error, be conservative and reject the match
-                        return False, f"Verification failed: {str(e)}"
-                
-                # ---- Select best match using LLM reasoning ----
-                def select_best_match(products, query):
-                    """Use Gemini to reason which product best matches the query.
-                    Returns the product dict or None if no suitable match.
-                    """
-                    match_prompt = f"""
-                    You are given a search query and a list of product candidates.
-                    Query: \"{query}\"
-                    Products (each with name, regular_price, membership_price, unit_price):
-                    {json.dumps(products, indent=2)}
-                    
-                    Your task is to pick the product that most closely matches the query.
-                    Consider brand, size (ml, l, g, kg), packaging (e.g., 4x250ml), and type.
-                    If none of the products seem to match the query, respond with the word NONE.
-                    
-                    Respond with a JSON object containing the chosen product (exactly as in the list) or the string "NONE".
-                    Example response:
-                    {{"name": "Arla Big Milk Fresh Whole Milk Vitamin Enriched for kids 4 X250ml", "regular_price": "£3.75", "membership_price": "£2.75", "unit_price": "£2.75/litre"}}
-                    or
-                    "NONE"
-                    """
-                    response = vision_model.generate_content([match_prompt])
-                    txt = response.text.strip()
-                    print(f"🔍 LLM raw response: {txt[:200]}...")  # Debug print
-                    # Remove markdown fences properly
-                    if txt.startswith("```"):
-                        lines = txt.split("\n")
-                        # Remove first line (```json or ```)
-                        lines = lines[1:]
-                        # Remove last line if it's just ```
-                        if lines and lines[-1].strip() == "```":
-                            lines = lines[:-1]
-                        txt = "\n".join(lines).strip()
-                    if txt.upper() == "NONE":
-                        return None
-                    try:
-                        parsed = json.loads(txt)
-                        if isinstance(parsed, dict):
-                            return parsed
-                        else:
-                            return None
-                    except Exception as e:
-                        print(f"⚠️ Failed to parse LLM response: {e}")
-                        return None
-                
-                def token_overlap(a: str, b: str) -> int:
-                    # Handle None values
-                    if a is None:
-                        a = ""
-                    if b is None:
-                        b = ""
-                    a_tokens = set(a.lower().split())
-                    b_tokens = set(b.lower().split())
-                    return len(a_tokens & b_tokens)
-                
-                # Step 1: Find the best candidate
-                best_product = select_best_match(products, query)
+                best_product = await best_task
                 
                 if best_product is None:
                     # Fallback: if LLM doesn't find a match, use token overlap
                     print("⚠️ LLM did not find a best match, falling back to token overlap.")
-                    best_score = 0
-                    for p in products:
-                        score = token_overlap(p.get("name", ""), query)
-                        if score > best_score:
-                            best_score = score
-                            best_product = p
+                    best_product = overlap_ranked[0] if overlap_ranked else None
                 
                 # Step 2: Verify the candidate is actually the same product
-                if best_product is not None:
-                    is_match, reason = verify_product_match(query, best_product)
-                    print(f"\n🔍 Verification result: {is_match}")
-                    print(f"   Reason: {reason}")
-                    
-                    if is_match:
-                        return {"results": [best_product], "from_vision": True}
+                # (clear-cut token overlap decides without another LLM call)
+                if best_product is not None and not needs_llm_verification(best_product):
+                    ratio = overlap_ratio(best_product.get("name", ""), query)
+                    is_match = ratio >= VERIFY_SKIP_ACCEPT_OVERLAP
+                    reason = f"Token overlap {ratio:.2f} with the query (LLM verification skipped)"
+                elif best_product is not None:
+                    verify_task = verify_tasks.pop(best_product.get("name"), None)
+                    if verify_task is not None:
+                        is_match, reason = await verify_task
                     else:
-                        # Product found but doesn't match - return helpful error
-                        return {
-                            "error": f"Product not found. Found '{best_product.get('name')}' but it doesn't match your search.",
-                            "reason": reason,
-                            "similar_products": products[:3],  # Show up to 3 similar products
-                            "results": []
-                        }
-                else:
-                    return {"error": "No suitable product found", "results": []}
-            except json.JSONDecodeError as e:
-                print(f"❌ Could not parse JSON: {e}")
-                print(f"Raw response: {products_json}")
-                return {"error": "Could not parse response", "raw": products_json, "results": []}
+                        is_match, reason = await verify_product_match(query, best_product)
+            finally:
+                for task in verify_tasks.values():
+                    task.cancel()
             
-        except Exception as e:
-            print(f"❌ Error: {e}")
-            import traceback
-            traceback.print_exc()
-            return {"error": str(e), "results": []}
+            if best_product is not None:
+                print(f"\n🔍 Verification result: {is_match}")
+                print(f"   Reason: {reason}")
+                
+                if is_match:
+                    return {"results": [best_product], "from_vision": True, "screenshot": screenshot_bytes}
+                else:
+                    # Product found but doesn't match - return helpful error
+                    return {
+                        "error": f"Product not found. Found '{best_product.get('name')}' but it doesn't match your search.",
+                        "reason": reason,
+                        "similar_products": products[:3],  # Show up to 3 similar products
+                        "results": [],
+                        "screenshot": screenshot_bytes
+                    }
+            else:
+                return {"error": "No suitable product found", "results": []}
+        except _json.JSONDecodeError as e:
+            print(f"❌ Could not parse JSON: {e}")
+            print(f"Raw response: {products_json}")
+            return {"error": "Could not parse response", "raw": products_json, "results": []}
         
-        finally:
-            await browser.close()
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return {"error": str(e), "results": []}
+    
+    finally:
+        await context.close()
 
 
 async def vision_fetch_product_with_visual_match(
@@ -1200,27 +1801,21 @@ async def vision_fetch_product_with_visual_match(
         simplified_query = simplify_product_name(query)
         print(f"   Simplified query: '{query}' -> '{simplified_query}'")
         
-        # Search with simplified name
-        result_simplified = await vision_fetch_product(supermarket, simplified_query)
+        # Search with simplified name (keeping its screenshot for the visual check)
+        result_simplified = await _vision_fetch(supermarket, simplified_query)
+        candidate_screenshot = result_simplified.pop("screenshot", None)
         
         # If we got candidates, use visual comparison
         if result_simplified.get("similar_products") or (result_simplified.get("results") and len(result_simplified["results"]) > 0):
            
-            # Load reference image
-            with open(reference_image_path, 'rb') as f:
-                ref_image_bytes = f.read()
-            
-            # Get candidate image from the latest screenshot
-            supermarket_key = supermarket.lower().strip()
-            candidate_screenshot = str(BASE_DIR / "debug" / f"debug_vision_{supermarket_key}.png")
+            # Load reference image (file I/O off the event loop)
+            ref_image_bytes = await asyncio.to_thread(Path(reference_image_path).read_bytes)
             
-            if Path(candidate_screenshot).exists():
-                with open(candidate_screenshot, 'rb') as f:
-                    full_candidate_screenshot = f.read()
-                
+            # Get candidate image from the simplified search's screenshot
+            if candidate_screenshot:
                 # Crop candidate to just product image too
                 print(f"   🔍 Extracting candidate product image...")
-                candidate_image_bytes = await crop_to_product_image(query, full_candidate_screenshot)
+                candidate_image_bytes = await crop_to_product_image(query, candidate_screenshot)
                 
                 # Only proceed if cropping was successful
                 if not candidate_image_bytes:
@@ -1244,8 +1839,7 @@ async def vision_fetch_product_with_visual_match(
                 safe_supermarket = supermarket.replace(" ", "_")
                 debug_image_path = debug_folder / f"{safe_product_name}_{safe_supermarket}.png"
                 
-                with open(debug_image_path, 'wb') as f:
-                    f.write(candidate_image_bytes)
+                await asyncio.to_thread(debug_image_path.write_bytes, candidate_image_bytes)
                 print(f"   💾 Saved candidate image to: {debug_image_path}")
                 
                 # Import and use image comparator
@@ -1284,7 +1878,10 @@ async def vision_fetch_product_with_visual_match(
 
 # Test function
 async def test_vision_fetch():
-    result = await vision_fetch_product("Tesco", "Tunnocks Milk Chocolate Caramel Wafer Biscuits")
+    try:
+        result = await vision_fetch_product("Tesco", "Tunnocks Milk Chocolate Caramel Wafer Biscuits")
+    finally:
+        await close_browser()
     
     print("\n" + "="*50)
     print("FINAL RESULTS")
@@ -1,49 +1,148 @@
 import csv
+import re
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Iterator, Tuple
 
-def read_products_csv(file_path: Path) -> List[Dict[str, str]]:
+# Characters that can't appear in an agent name
+_SAFE_RE = re.compile(r'[^a-zA-Z0-9_]+')
+
+
+class _SafeCharTable(dict):
+    """str.translate table keeping ASCII alphanumerics and '_'; any other
+    character (including non-ASCII) maps to '_'."""
+    def __missing__(self, codepoint: int) -> str:
+        return '_'
+
+
+# One-for-one character replacement, equivalent to re.sub(r'[^a-zA-Z0-9_]', '_', text)
+SAFE_CHAR_TABLE = _SafeCharTable(
+    (ord(c), c) for c in 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_'
+)
+
+
+@dataclass(frozen=True, slots=True)
+class ProductRecord:
+    """One CSV product row, normalized once after loading.
+    The fields used per product are attributes; ``data`` keeps the full row
+    for the agents (current prices etc.)."""
+    product_name: str
+    safe_name: str
+    current_supermarket: str
+    data: Dict[str, str]
+    # Later CSV rows with the same (product_name, current_supermarket); they reuse
+    # this product's search but keep their own current prices
+    duplicates: Tuple[Dict[str, str], ...] = ()
+
+
+def make_safe_name(text: str) -> str:
+    """Convert text to a valid identifier fragment (alphanumeric + underscore only)"""
+    return _SAFE_RE.sub('_', text).strip('_')
+
+
+def to_product_records(groups: List[List[Dict[str, str]]]) -> List[ProductRecord]:
+    """
+    Build a ProductRecord (with precomputed safe name) for every product group
+    from ``group_products``, once, right after loading the CSV. The first row of
+    each group is the product; the rest become its ``duplicates``.
+    """
+    return [
+        ProductRecord(
+            product_name=first['product_name'],
+            safe_name=make_safe_name(first['product_name']),
+            current_supermarket=first.get('current_supermarket', 'Tesco'),
+            data=first,
+            duplicates=tuple(rest)
+        )
+        for first, *rest in groups
+    ]
+
+
+def group_products(products: List[Dict[str, str]]) -> List[List[Dict[str, str]]]:
     """
-    Reads the products CSV file and returns a list of dictionaries.
-    Each dictionary represents a row in the CSV.
+    Group rows by (product_name, current_supermarket), in first-seen order,
+    so each unique product only runs through the pipeline once and its result
+    can be applied to every row of the group.
+    """
+    groups = {}
+    for p in products:
+        groups.setdefault((p['product_name'], p.get('current_supermarket')), []).append(p)
+    return list(groups.values())
+
+
+def read_products_csv(file_path: Path) -> Iterator[Dict[str, str]]:
+    """
+    Reads the products CSV file lazily, yielding one dictionary per row.
+    A missing file raises FileNotFoundError right away, not on first iteration.
+    Use list(...) when the rows are needed all at once.
     """
-    products = []
     if not file_path.exists():
         raise FileNotFoundError(f"CSV file not found at {file_path}")
+    return _iter_csv_rows(file_path)
 
-    with open(file_path, mode='r', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            products.append(row)
-    return products
-
-def write_results_csv(file_path: Path, results: List[Dict[str, Any]]):
-    """
-    Writes the optimization results to a CSV file.
-    Creates an empty CSV with headers even if results list is empty.
-    """
-    # Define expected headers for optimization results
-    fieldnames = [
-        "product_name",
-        "current_supermarket",
-        "current_regular_price",
-        "current_membership_price",
-        "cheapest_supermarket",
-        "cheapest_regular_price",
-        "cheapest_membership_price",
-        "savings_vs_current",
-        "saving_cheapest_regular_vs_current_regular",
-        "saving_cheapest_regular_vs_current_membership",
-        "saving_cheapest_membership_vs_current_regular",
-        "saving_cheapest_membership_vs_current_membership"
-    ]
-    
-    # If results exist, use their keys (in case format changes)
-    if results:
-        fieldnames = results[0].keys()
-
-    with open(file_path, mode='w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        if results:
-            writer.writerows(results)
+
+def _iter_csv_rows(file_path: Path) -> Iterator[Dict[str, str]]:
+    # newline='' lets the csv module handle line endings; 1 MiB read buffer
+    with open(file_path, mode='r', encoding='utf-8', newline='', buffering=1 << 20) as csvfile:
+        yield from csv.DictReader(csvfile)
+
+
+# Columns of the optimization results CSV (OptimizationResult.to_dict() keys)
+RESULTS_FIELDNAMES = [
+    "product_name",
+    "current_supermarket",
+    "current_regular_price",
+    "current_membership_price",
+    "cheapest_supermarket",
+    "cheapest_regular_price",
+    "cheapest_membership_price",
+    "savings_vs_current",
+    "saving_cheapest_regular_vs_current_regular",
+    "saving_cheapest_regular_vs_current_membership",
+    "saving_cheapest_membership_vs_current_regular",
+    "saving_cheapest_membership_vs_current_membership"
+]
+
+
+class StreamingResultsWriter:
+    """
+    Writes optimization results to the CSV as products finish, instead of one
+    dump at the end of the run: rows already written survive a crash and don't
+    pile up in memory.
+
+    The file is replaced (header first) when the writer opens.
+    Rows are flushed every ``flush_every`` calls to write_rows.
+    Use as a context manager, or call close().
+    """
+
+    def __init__(self, file_path: Path, fieldnames: List[str] = None, flush_every: int = 1):
+        # historical_low_warning is only set on some results, so the column is always present
+        self.fieldnames = fieldnames or RESULTS_FIELDNAMES + ["historical_low_warning"]
+        self.flush_every = max(1, flush_every)
+        self.rows_written = 0
+        self._pending_writes = 0
+        self._file = open(file_path, mode='w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(self.fieldnames)
+        self._file.flush()
+
+    def write_rows(self, rows):
+        """Write an iterable of result dicts (e.g. one product's results)."""
+        fieldnames = self.fieldnames
+        for row in rows:
+            self._writer.writerow([row.get(name, '') for name in fieldnames])
+            self.rows_written += 1
+        self._pending_writes += 1
+        if self._pending_writes >= self.flush_every:
+            self._file.flush()
+            self._pending_writes = 0
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,4 +1,18 @@
 """Display utilities for pretty-printing results and comparisons"""
+import math
+
+
+def _price_value(price) -> float:
+    """Numeric value of a price like '£1,234.50' (math.inf if missing or unparsable)"""
+    if not price:
+        return math.inf
+    if isinstance(price, str):
+        price = price.replace('£', '').replace(',', '')
+    try:
+        return float(price)
+    except ValueError:
+        return math.inf
+
 
 def print_price_comparison(product_name: str, search_results: list) -> str:
     """Print a nice price comparison table for a product and return the string"""
@@ -43,13 +57,14 @@ def print_price_comparison(product_name: str, search_results: list) -> str:
             'regular': regular,
             'membership': membership,
             'best_price': price_val,
+            'best_price_f': _price_value(price_val),  # parsed once, used by the min() below
             'price_type': price_type
         })
     
     # Find cheapest
     valid_prices = [p for p in prices_with_supermarket if p['best_price']]
     if valid_prices:
-        cheapest = min(valid_prices, key=lambda x: float(x['best_price'].replace('£', '').replace(',', '')) if x['best_price'] else float('inf'))
+        cheapest = min(valid_prices, key=lambda x: x['best_price_f'])
         cheapest_supermarket = cheapest['supermarket']
     else:
         cheapest_supermarket = None
@@ -69,7 +84,7 @@ def print_price_comparison(product_name: str, search_results: list) -> str:
             line = f"{emoji} {supermarket:15} │ Regular: {regular_str:8} │ Member: {membership_str:8}"
             
             if is_cheapest:
-                line += f" │ ⭐ BEST PRICE!"
+                line += " │ ⭐ BEST PRICE!"
             
             log(line)
         else:
@@ -1,8 +1,13 @@
 from graphviz import Digraph
+import argparse
+import hashlib
 import os
 
-def generate_agent_hierarchy():
-    dot = Digraph(comment='Agent Hierarchy', format='png')
+def generate_agent_hierarchy(fmt: str = 'svg'):
+    """Render the agent hierarchy diagram to docs/images/agent_hierarchy.<fmt>.
+    SVG (the default) skips rasterization; pass fmt='png' for the image embedded
+    in AGENT_ARCHITECTURE.md."""
+    dot = Digraph(comment='Agent Hierarchy', format=fmt)
     dot.attr(rankdir='TB', splines='ortho', nodesep='0.6', ranksep='0.8')
     
     # Global node styles
@@ -52,10 +57,33 @@ def generate_agent_hierarchy():
     dot.edge('User', 'Tesco', lhead='cluster_Coordinator') 
     dot.edge('Optimizer', 'Report')
 
-    # Render
-    output_path = 'docs/images/agent_hierarchy'
-    dot.render(output_path, cleanup=True)
-    print(f"Diagram generated at {output_path}.png")
+    # Render (skipped when this format was already rendered from this exact DOT source)
+    output_path = f"docs/images/agent_hierarchy.{fmt}"
+    hash_path = f"{output_path}.sha256"
+    source_hash = hashlib.sha256(dot.source.encode('utf-8')).hexdigest()
+    try:
+        with open(hash_path) as f:
+            unchanged = f.read().strip() == source_hash and os.path.exists(output_path)
+    except FileNotFoundError:
+        unchanged = False
+    if unchanged:
+        print(f"Diagram unchanged, keeping {output_path}")
+        return
+    
+    # Pipe the DOT source through Graphviz in memory (no intermediate .gv file),
+    # then move the output and its sidecar hash into place atomically
+    rendered = dot.pipe(format=fmt)
+    with open(f"{output_path}.tmp", 'wb') as f:
+        f.write(rendered)
+    os.replace(f"{output_path}.tmp", output_path)
+    with open(f"{hash_path}.tmp", 'w') as f:
+        f.write(source_hash)
+    os.replace(f"{hash_path}.tmp", hash_path)
+    print(f"Diagram generated at {output_path}")
 
 if __name__ == "__main__":
-    generate_agent_hierarchy()
+    parser = argparse.ArgumentParser(description="Render the agent hierarchy diagram")
+    parser.add_argument("--png", action="store_true",
+                        help="render the PNG used by AGENT_ARCHITECTURE.md instead of SVG")
+    args = parser.parse_args()
+    generate_agent_hierarchy('png' if args.png else 'svg')
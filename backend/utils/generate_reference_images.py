@@ -10,24 +10,35 @@ These reference images serve as templates for visual comparison when searching
 for the same products on other supermarket websites.
 """
 
+import argparse
 import asyncio
-import csv
+import itertools
+import json
+import os
 import sys
 from pathlib import Path
 
 # Add backend directory to path (parent of utils)
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from tools.vision_price_fetcher import capture_reference_image
+from config import MAX_CONCURRENT_PRODUCTS
+from tools.vision_price_fetcher import capture_reference_image, close_browser
+from utils.csv_handler import read_products_csv
 
 
-async def generate_all_reference_images():
-    """Generate reference images for all products in products.csv."""
+async def generate_all_reference_images(resume: bool = False):
+    """
+    Generate reference images for all products in products.csv.
+    
+    With ``resume``, products listed as successful in the previous results JSON
+    (whose image file still exists) are kept as-is instead of being captured again.
+    """
     
     # Path relative to project root (assuming script run from project root or backend/utils)
     # We'll use the config definitions if possible, but for now let's resolve relative to this file
     base_dir = Path(__file__).parent.parent # backend/
     products_csv = base_dir / "data" / "products.csv"
+    results_file = base_dir / "data" / "reference_image_generation_results.json"
     
     if not products_csv.exists():
         print(f"❌ Error: {products_csv} not found")
@@ -37,12 +48,9 @@ async def generate_all_reference_images():
     print("GENERATING REFERENCE IMAGES FOR ALL PRODUCTS")
     print("=" * 70)
     
-    # Read products from CSV
-    products = []
-    with open(products_csv, 'r') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            products.append(row)
+    # Read products from CSV (shared reader with main.py); the progress
+    # counter and the gather below need them all up front
+    products = list(read_products_csv(products_csv))
     
     print(f"\n📋 Found {len(products)} products in products.csv\n")
     
@@ -52,44 +60,80 @@ async def generate_all_reference_images():
         'failed': []
     }
     
-    # Process each product
-    for i, product in enumerate(products, 1):
+    # Successful captures from the previous run, keyed by (product, supermarket)
+    previous = {}
+    if resume:
+        try:
+            with open(results_file) as f:
+                previous = {
+                    (item['product'], item['supermarket']): item
+                    for item in json.load(f).get('success', [])
+                    if os.path.exists(item.get('path', ''))
+                }
+            print(f"⏭️  Resuming: {len(previous)} reference images already generated\n")
+        except FileNotFoundError:
+            print("⚠️  No previous results to resume from, generating all images\n")
+        except (json.JSONDecodeError, KeyError, AttributeError) as e:
+            print(f"⚠️  Could not read previous results ({e}), generating all images\n")
+    pending = sum(1 for p in products if (p['product_name'], p['current_supermarket']) not in previous)
+    
+    # Capture all products concurrently, at most MAX_CONCURRENT_PRODUCTS at a time
+    # (same bound main.py uses for its product pipelines)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_PRODUCTS)
+    started = itertools.count(1)  # progress counter (single event loop, no locking needed)
+    
+    async def _one(product):
+        """Capture one product's reference image; returns (outcome, entry)."""
         product_name = product['product_name']
         supermarket = product['current_supermarket']
         
-        print(f"\n{'=' * 70}")
-        print(f"[{i}/{len(products)}] Processing: {product_name}")
-        print(f"           Supermarket: {supermarket}")
-        print('=' * 70)
+        previous_entry = previous.get((product_name, supermarket))
+        if previous_entry:
+            return 'success', previous_entry
         
-        try:
-            # Capture reference image
-            ref_path = await capture_reference_image(supermarket, product_name)
+        async with semaphore:
+            i = next(started)
+            print(f"\n{'=' * 70}")
+            print(f"[{i}/{pending}] Processing: {product_name}")
+            print(f"           Supermarket: {supermarket}")
+            print('=' * 70)
             
-            if ref_path:
-                results['success'].append({
+            try:
+                # Capture reference image
+                ref_path = await capture_reference_image(supermarket, product_name)
+                
+                if ref_path:
+                    print(f"\n✅ SUCCESS: Reference image saved to {ref_path}")
+                    return 'success', {
+                        'product': product_name,
+                        'supermarket': supermarket,
+                        'path': ref_path
+                    }
+                print(f"\n❌ FAILED: Could not generate reference image for {product_name}")
+                return 'failed', {
                     'product': product_name,
                     'supermarket': supermarket,
-                    'path': ref_path
-                })
-                print(f"\n✅ SUCCESS: Reference image saved to {ref_path}")
-            else:
-                results['failed'].append({
+                    'reason': 'No reference image path returned'
+                }
+                    
+            except Exception as e:
+                print(f"\n❌ ERROR ({product_name}): {e}")
+                import traceback
+                traceback.print_exc()
+                return 'failed', {
                     'product': product_name,
                     'supermarket': supermarket,
-                    'reason': 'No reference image path returned'
-                })
-                print(f"\n❌ FAILED: Could not generate reference image")
-                
-        except Exception as e:
-            results['failed'].append({
-                'product': product_name,
-                'supermarket': supermarket,
-                'reason': str(e)
-            })
-            print(f"\n❌ ERROR: {e}")
-            import traceback
-            traceback.print_exc()
+                    'reason': str(e)
+                }
+    
+    try:
+        outcomes = await asyncio.gather(*[_one(product) for product in products])
+    finally:
+        await close_browser()
+    
+    # Outcomes come back in products.csv order
+    for outcome, entry in outcomes:
+        results[outcome].append(entry)
     
     # Print summary
     print("\n" + "=" * 70)
@@ -111,14 +155,26 @@ async def generate_all_reference_images():
     print(f"Total: {len(results['success'])}/{len(products)} reference images generated")
     print("=" * 70)
     
-    # Save results to JSON for later reference
-    import json
-    results_file = base_dir / "data" / "reference_image_generation_results.json"
-    with open(results_file, 'w') as f:
+    # Save results to JSON for later reference (temp file + os.replace, so an
+    # interrupted write never leaves a truncated file for --resume)
+    tmp_file = results_file.with_suffix('.json.tmp')
+    with open(tmp_file, 'w') as f:
         json.dump(results, f, indent=2)
+    os.replace(tmp_file, results_file)
     
     print(f"\n💾 Results saved to: {results_file}")
 
 
 if __name__ == "__main__":
-    asyncio.run(generate_all_reference_images())
+    parser = argparse.ArgumentParser(description="Generate reference images for all products in products.csv")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip products already captured successfully in the previous run")
+    args = parser.parse_args()
+    
+    # uvloop (libuv-based event loop) cuts per-await overhead when installed
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(generate_all_reference_images(resume=args.resume))
+    else:
+        uvloop.run(generate_all_reference_images(resume=args.resume))
@@ -1,9 +1,19 @@
 import pandas as pd
+from collections import defaultdict
 from pathlib import Path
 from datetime import datetime
 from typing import List, Dict, Any
 import os
 
+
+def _read_csv(file_path) -> pd.DataFrame:
+    """pd.read_csv using pyarrow's multithreaded C++ parser, or pandas' own parser without pyarrow"""
+    try:
+        return pd.read_csv(file_path, engine="pyarrow")
+    except ImportError:
+        return pd.read_csv(file_path)
+
+
 class HistoricalPriceTracker:
     def __init__(self, history_dir: str = None):
         if history_dir is None:
@@ -25,7 +35,7 @@ class HistoricalPriceTracker:
         
         # 1. Get master list of products
         try:
-            master_products_df = pd.read_csv(products_csv_path)
+            master_products_df = _read_csv(products_csv_path)
             master_product_names = master_products_df['product_name'].unique()
         except Exception as e:
             print(f"⚠️ Error reading products.csv: {e}")
@@ -33,12 +43,10 @@ class HistoricalPriceTracker:
 
         # 2. Group results by supermarket
         print(f"   🔍 Tracker received {len(search_results)} search results")
-        results_by_market = {}
+        results_by_market = defaultdict(list)
         for res in search_results:
             market = res.get('supermarket')
             if market:
-                if market not in results_by_market:
-                    results_by_market[market] = []
                 results_by_market[market].append(res)
         
         print(f"   🔍 Found supermarkets: {list(results_by_market.keys())}")
@@ -54,7 +62,7 @@ class HistoricalPriceTracker:
         # Load or Create DataFrame
         if file_path.exists():
             try:
-                df = pd.read_csv(file_path)
+                df = _read_csv(file_path)
                 if 'Product' in df.columns:
                     df.set_index('Product', inplace=True)
             except Exception:
@@ -71,46 +79,52 @@ class HistoricalPriceTracker:
             
         # Add missing rows
         new_rows = [r for r in required_rows if r not in df.index]
+        changed = bool(new_rows)
         if new_rows:
-            new_df = pd.DataFrame(index=new_rows)
-            df = pd.concat([df, new_df])
+            # One reindex onto the union of labels (new rows start empty) instead of concat
+            df = df.reindex(df.index.union(pd.Index(new_rows)))
+        df.index.name = 'Product'
             
         # Ensure date column exists
         if date_col not in df.columns:
             df[date_col] = None  # Initialize with None/NaN
+            changed = True
 
-        # Update prices
-        updates = 0
+        # Update prices: gather (row key, price) pairs, then write them in one column update
+        row_keys = []
+        prices = []
         for res in results:
             p_name = res.get('product')
             if not p_name:
                 continue
-                
-            reg_price = res.get('regular_price')
-            mem_price = res.get('membership_price')
-            
-            # Clean prices (remove currency symbol)
-            if reg_price and isinstance(reg_price, str):
-                reg_price = reg_price.replace('£', '')
-            if mem_price and isinstance(mem_price, str):
-                mem_price = mem_price.replace('£', '')
-                
-            # Update Regular Price
-            row_key_reg = f"{p_name} - Regular"
-            if row_key_reg in df.index and reg_price:
-                df.at[row_key_reg, date_col] = reg_price
-                updates += 1
-                
-            # Update Membership Price
-            row_key_mem = f"{p_name} - Membership"
-            if row_key_mem in df.index and mem_price:
-                df.at[row_key_mem, date_col] = mem_price
-                updates += 1
+            row_keys.append(f"{p_name} - Regular")
+            prices.append(res.get('regular_price'))
+            row_keys.append(f"{p_name} - Membership")
+            prices.append(res.get('membership_price'))
+        
+        update = pd.Series(prices, index=row_keys, dtype=object)
+        # Clean prices (remove currency symbol) - string values only, others are kept as-is
+        # (masks are positional arrays: row keys repeat when a product has several results)
+        is_str = update.map(lambda v: isinstance(v, str)).to_numpy(dtype=bool)
+        if is_str.any():
+            update[is_str] = update[is_str].str.replace('£', '', regex=False).to_numpy()
+        # Keep non-empty prices for known rows; a repeated row keeps its last price
+        update = update[update.astype(bool).to_numpy() & update.index.isin(df.index)]
+        updates = len(update)
+        update = update[~update.index.duplicated(keep='last')]
+        if not update.empty:
+            df.loc[update.index, date_col] = update.values
+            changed = True
+        
+        # Nothing new (same rows, today's column already there, no prices): keep the file as-is
+        if not changed:
+            print(f"   💾 {market} history already up to date")
+            return
                 
         # Save back to CSV
         try:
             df.sort_index(inplace=True) # Sort rows alphabetically
-            df.reset_index().rename(columns={'index': 'Product'}).to_csv(file_path, index=False)
+            df.reset_index().to_csv(file_path, index=False)
             print(f"   💾 Updated {market} history with {updates} prices")
         except Exception as e:
             print(f"❌ Error saving {market} history: {e}")
@@ -3,24 +3,44 @@ Image storage utilities for product reference images.
 Handles saving and loading product images for visual comparison.
 """
 
+import asyncio
 import os
 import re
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional, Tuple
+
+from utils.csv_handler import SAFE_CHAR_TABLE
 
 # Storage directory for product images
 IMAGES_DIR = Path(__file__).parent.parent / "data" / "product_images"
 
+# (product_name, supermarket) -> absolute path of images known to exist.
+# Only hits are remembered, so an image saved later is still found.
+_existing_image_paths: Dict[Tuple[str, str], str] = {}
+
+
+_UNDERSCORES_RE = re.compile(r'_+')
+
 
 def _sanitize_filename(text: str) -> str:
     """Convert text to safe filename (alphanumeric + underscore only)"""
-    safe = re.sub(r'[^a-zA-Z0-9_]', '_', text)
+    # One C-level translate pass (ASCII alphanumerics and '_' kept, anything else -> '_')
+    safe = text.translate(SAFE_CHAR_TABLE)
     # Collapse multiple underscores
-    safe = re.sub(r'_+', '_', safe).strip('_')
+    safe = _UNDERSCORES_RE.sub('_', safe).strip('_')
     # Limit length
     return safe[:100]
 
 
+@lru_cache(maxsize=1024)
+def _image_filepath(product_name: str, supermarket: str) -> Path:
+    """Path where the image for (product_name, supermarket) is stored"""
+    safe_product = _sanitize_filename(product_name)
+    safe_supermarket = _sanitize_filename(supermarket)
+    return IMAGES_DIR / f"{safe_product}_{safe_supermarket}.png"
+
+
 def save_product_image(product_name: str, supermarket: str, image_bytes: bytes) -> str:
     """
     Save a product image to disk.
@@ -37,18 +57,27 @@ def save_product_image(product_name: str, supermarket: str, image_bytes: bytes)
     IMAGES_DIR.mkdir(parents=True, exist_ok=True)
     
     # Create safe filename
-    safe_product = _sanitize_filename(product_name)
-    safe_supermarket = _sanitize_filename(supermarket)
-    filename = f"{safe_product}_{safe_supermarket}.png"
-    
-    filepath = IMAGES_DIR / filename
+    filepath = _image_filepath(product_name, supermarket)
     
     # Save image
     with open(filepath, 'wb') as f:
         f.write(image_bytes)
     
     print(f"💾 Saved product image: {filepath}")
-    return str(filepath.absolute())
+    path = str(filepath.absolute())
+    _existing_image_paths[(product_name, supermarket)] = path
+    return path
+
+
+async def save_product_image_async(product_name: str, supermarket: str, image_bytes: bytes) -> str:
+    """
+    Async version of save_product_image: the disk write runs in a worker thread,
+    so capture pipelines keep fetching while the image is written.
+    
+    Returns:
+        str: Absolute path to the saved image
+    """
+    return await asyncio.to_thread(save_product_image, product_name, supermarket, image_bytes)
 
 
 def get_product_image(product_name: str, supermarket: str) -> Optional[bytes]:
@@ -62,11 +91,7 @@ def get_product_image(product_name: str, supermarket: str) -> Optional[bytes]:
     Returns:
         bytes: Image data if found, None otherwise
     """
-    safe_product = _sanitize_filename(product_name)
-    safe_supermarket = _sanitize_filename(supermarket)
-    filename = f"{safe_product}_{safe_supermarket}.png"
-    
-    filepath = IMAGES_DIR / filename
+    filepath = _image_filepath(product_name, supermarket)
     
     if not filepath.exists():
         return None
@@ -86,20 +111,27 @@ def get_product_image_path(product_name: str, supermarket: str) -> Optional[str]
     Returns:
         str: Absolute path if image exists, None otherwise
     """
-    safe_product = _sanitize_filename(product_name)
-    safe_supermarket = _sanitize_filename(supermarket)
-    filename = f"{safe_product}_{safe_supermarket}.png"
+    key = (product_name, supermarket)
+    path = _existing_image_paths.get(key)
+    if path is not None:
+        return path
     
-    filepath = IMAGES_DIR / filename
+    filepath = _image_filepath(product_name, supermarket)
     
     if filepath.exists():
-        return str(filepath.absolute())
+        path = str(filepath.absolute())
+        _existing_image_paths[key] = path
+        return path
     return None
 
 
 def clear_product_images():
     """Remove all stored product images (for testing/cleanup)"""
+    _existing_image_paths.clear()
     if IMAGES_DIR.exists():
+        # Count while deleting (one directory scan)
+        cleared = 0
         for file in IMAGES_DIR.glob("*.png"):
             file.unlink()
-        print(f"🗑️  Cleared {len(list(IMAGES_DIR.glob('*.png')))} product images")
+            cleared += 1
+        print(f"🗑️  Cleared {cleared} product images")
@@ -7,12 +7,12 @@ import re
 from typing import List
 
 # Common stopwords to remove
-STOPWORDS = {
+STOPWORDS = frozenset({
     'pack', 'multipack', 'box', 'packet', 'bag',
     'gluten', 'free', 'organic', 'natural',
     'fresh', 'frozen', 'chilled',
     'x', 'of', 'the', 'and', '&',
-}
+})
 
 # Size/quantity patterns to remove
 SIZE_PATTERNS = [
@@ -22,6 +22,23 @@ SIZE_PATTERNS = [
     r'\d+%',           # Percentages
 ]
 
+# Patterns compiled once at import
+_SIZE_RES = [re.compile(pattern, re.IGNORECASE) for pattern in SIZE_PATTERNS]
+_NON_WORD_RE = re.compile(r'[^\w\s]')
+
+# Common product type words (nouns that describe the product)
+PRODUCT_TYPES = frozenset({
+    'biscuit', 'biscuits', 'cookie', 'cookies',
+    'chocolate', 'bar', 'bars',
+    'praline', 'pralines',
+    'wafer', 'wafers',
+    'cake', 'cakes',
+    'cereal', 'oat', 'oats',
+    'milk', 'cheese', 'yogurt', 'butter',
+    'bread', 'roll', 'rolls',
+    'chip', 'chips', 'crisp', 'crisps',
+})
+
 
 def simplify_product_name(full_name: str) -> str:
     """
@@ -47,11 +64,11 @@ def simplify_product_name(full_name: str) -> str:
     name = full_name.lower()
     
     # Remove size/quantity patterns
-    for pattern in SIZE_PATTERNS:
-        name = re.sub(pattern, '', name, flags=re.IGNORECASE)
+    for pattern in _SIZE_RES:
+        name = pattern.sub('', name)
     
     # Remove hyphens and special characters (except letters, numbers, spaces)
-    name = re.sub(r'[^\w\s]', ' ', name)
+    name = _NON_WORD_RE.sub(' ', name)
     
     # Split into words
     words = name.split()
@@ -65,34 +82,15 @@ def simplify_product_name(full_name: str) -> str:
         return full_name  # Fallback to original
     
     # Always keep first word (brand)
-    result_words = [words[0]]
+    brand, rest = words[0], words[1:]
     
-    # Find the main product type (look for common product words)
-    product_types = [
-        'biscuit', 'biscuits', 'cookie', 'cookies',
-        'chocolate', 'bar', 'bars',
-        'praline', 'pralines',
-        'wafer', 'wafers',
-        'cake', 'cakes',
-        'cereal', 'oat', 'oats',
-        'milk', 'cheese', 'yogurt', 'butter',
-        'bread', 'roll', 'rolls',
-        'chip', 'chips', 'crisp', 'crisps',
-    ]
-    
-    for word in words[1:]:
-        if word in product_types or len(result_words) < 2:
-            result_words.append(word)
-            if len(result_words) >= 2:
-                break
+    # Main product type: the first common product word, else the word after the brand
+    product_type = next((w for w in rest if w in PRODUCT_TYPES), rest[0] if rest else None)
+    result_words = [brand, product_type] if product_type else [brand]
     
     # Capitalize first letter of each word
     simplified = ' '.join(w.capitalize() for w in result_words)
     
-    # If we only got one word, try to get one more
-    if len(result_words) == 1 and len(words) > 1:
-        simplified += ' ' + words[1].capitalize()
-    
     return simplified
 
 